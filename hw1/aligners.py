@@ -0,0 +1,511 @@
+"""
+This module contains the alignment engines used by processdata.py to find
+where each read appears in the reference sequence.
+"""
+
+# Import useful modules
+import collections
+import hashlib
+import os
+import pickle
+
+class AlignmentCache:
+    """
+    AlignmentCache: stores the alignments of recently seen reads.
+
+    Many reads repeat, so the alignment of each distinct read is kept and
+    reused rather than searching the reference again. The cache holds at
+    most a fixed number of reads; when it is full, the read that was used
+    least recently is removed.
+
+    Attributes:
+    -----------
+    maxSize : int
+        the largest number of reads stored. The cache is disabled if 0.
+    alignments : OrderedDict
+        the alignment of each read, ordered from least to most recently used
+
+    Methods:
+    --------
+    get(read)
+        returns the stored alignment of a read, or None if it is not stored
+    put(read,alignment)
+        stores the alignment of a read
+    """
+
+    def __init__(self,maxSize):
+        """
+        Constructs an empty cache holding at most maxSize reads.
+        """
+        if maxSize < 0:
+            raise RuntimeError("Cache size must not be negative")
+        self.maxSize = maxSize
+        self.alignments = collections.OrderedDict()
+
+    def __len__(self):
+        """
+        Returns the number of reads stored.
+        """
+        return len(self.alignments)
+
+    def get(self,read):
+        """
+        Returns the stored alignment of a read, marking it as the most
+        recently used, or None if the read is not stored.
+        """
+        alignment = self.alignments.get(read)
+        if alignment is not None:
+            self.alignments.move_to_end(read)
+        return alignment
+
+    def put(self,read,alignment):
+        """
+        Stores the alignment of a read, removing the least recently used
+        read if the cache is full.
+        """
+        if self.maxSize == 0:
+            return
+        self.alignments[read] = alignment
+        self.alignments.move_to_end(read)
+        if len(self.alignments) > self.maxSize:
+            self.alignments.popitem(last=False)
+
+
+class FindAligner:
+    """
+    FindAligner: aligns reads using repeated searches of the reference.
+
+    This is the original alignment method, which calls the string find
+    function once to get the first alignment and again to get the second.
+    Each search scans the reference, so the cost is proportional to the
+    reference length for every read.
+
+    Attributes:
+    -----------
+    reference : str
+        the reference sequence
+
+    Methods:
+    --------
+    align(read)
+        returns a tuple with the first and second alignment positions
+    align_all(reads)
+        returns a list with the alignment positions of each read
+    """
+
+    def __init__(self,reference):
+        """
+        Constructs an aligner for the given reference sequence.
+        """
+        self.reference = reference
+
+    def __len__(self):
+        """
+        Returns the length of the reference sequence.
+        """
+        return len(self.reference)
+
+    def align(self,read):
+        """
+        Finds the first two positions where the read appears in the reference.
+
+        Positions that are not found are given as -1, matching the output
+        of the find function.
+        """
+        firstAlign = self.reference.find(read)
+        secondAlign = -1
+        if firstAlign >= 0:
+            secondAlign = self.reference.find(read,firstAlign+1)
+        return (firstAlign,secondAlign)
+
+    def align_all(self,reads):
+        """
+        Aligns a list of reads, returning a list with the first and second
+        alignment positions of each read.
+        """
+        results = []
+        for read in reads:
+            results.append(self.align(read))
+        return results
+
+
+class KmerAligner(FindAligner):
+    """
+    KmerAligner: aligns reads using a k-mer (seed) hash index.
+
+    The index maps every substring of length k in the reference to a sorted
+    list of the positions where it starts. To align a read, the seed in the
+    read with the fewest occurrences is looked up, and only the positions
+    it gives are checked against the full read. Reads shorter than k are
+    aligned by searching the reference directly.
+
+    Attributes:
+    -----------
+    reference : str
+        the reference sequence
+    k : int
+        the length of the seeds stored in the index
+    index : dict
+        the positions of each seed. Keys are strings, values are lists.
+
+    Methods:
+    --------
+    build_index()
+        returns a dictionary with the positions of every seed
+    load_index(indexFile)
+        returns the index stored in a file, or None if it does not match
+    save_index(indexFile)
+        writes the index to a file
+    align(read)
+        returns a tuple with the first and second alignment positions
+    """
+
+    def __init__(self,reference,k=12,indexFile=None):
+        """
+        Constructs an aligner for the given reference sequence.
+
+        If an index file is given and it was built from the same reference
+        with the same k, the index is loaded from it. Otherwise the index is
+        built and, if a file name was given, saved for later runs.
+        """
+        FindAligner.__init__(self,reference)
+        if k < 1:
+            raise RuntimeError("k-mer length must be positive")
+        self.k = k
+        self.index = None
+        if indexFile is not None and os.path.exists(indexFile):
+            self.index = self.load_index(indexFile)
+        if self.index is None:
+            self.index = self.build_index()
+            if indexFile is not None:
+                self.save_index(indexFile)
+
+    def checksum(self):
+        """
+        Returns a hash of the reference, used to check that a saved index
+        belongs to this reference.
+        """
+        return hashlib.sha1(self.reference.encode()).hexdigest()
+
+    def build_index(self):
+        """
+        Records the starting position of every seed in the reference.
+
+        Positions are added in increasing order, so every list in the index
+        is sorted.
+        """
+        index = dict()
+        k = self.k
+        reference = self.reference
+        for i in range(len(reference)-k+1):
+            seed = reference[i:i+k]
+            if seed in index:
+                index[seed].append(i)
+            else:
+                index[seed] = [i]
+        return index
+
+    def load_index(self,indexFile):
+        """
+        Reads a saved index.
+
+        Returns None if the file was written for a different reference or
+        seed length, so that the index is rebuilt instead.
+        """
+        with open(indexFile,'rb') as f:
+            saved = pickle.load(f)
+        if saved['k'] != self.k or saved['length'] != len(self.reference):
+            return None
+        if saved['checksum'] != self.checksum():
+            return None
+        return saved['index']
+
+    def save_index(self,indexFile):
+        """
+        Writes the index to a file, along with the information needed to
+        check that it matches the reference when it is loaded.
+        """
+        saved = {'k': self.k,
+                 'length': len(self.reference),
+                 'checksum': self.checksum(),
+                 'index': self.index}
+        with open(indexFile,'wb') as f:
+            pickle.dump(saved,f,pickle.HIGHEST_PROTOCOL)
+
+    def align(self,read):
+        """
+        Finds the first two positions where the read appears in the reference.
+
+        The read is split into seeds of length k (the last seed is moved back
+        so that it ends at the end of the read). The seed with the fewest
+        positions in the index gives the candidate starting positions, which
+        are checked in increasing order until two matches are found.
+        """
+        k = self.k
+        readLen = len(read)
+        if readLen < k:
+            return FindAligner.align(self,read)
+        offsets = list(range(0,readLen-k+1,k))
+        if offsets[-1] != readLen-k:
+            offsets.append(readLen-k)
+        # Find the seed with the fewest occurrences. If any seed is missing
+        # from the index, the read cannot appear in the reference.
+        bestOffset = 0
+        bestPositions = None
+        for offset in offsets:
+            positions = self.index.get(read[offset:offset+k])
+            if positions is None:
+                return (-1,-1)
+            if bestPositions is None or len(positions) < len(bestPositions):
+                bestOffset = offset
+                bestPositions = positions
+        # Check each candidate position against the whole read
+        found = []
+        lastStart = len(self.reference) - readLen
+        for position in bestPositions:
+            start = position - bestOffset
+            if start < 0 or start > lastStart:
+                continue
+            if self.reference.startswith(read,start):
+                found.append(start)
+                if len(found) == 2:
+                    break
+        while len(found) < 2:
+            found.append(-1)
+        return (found[0],found[1])
+
+
+class SeedExtendAligner(KmerAligner):
+    """
+    SeedExtendAligner: aligns reads allowing a number of mismatches.
+
+    If a read matches a part of the reference with at most m mismatches,
+    and the read is split into m+1 pieces, at least one piece has no
+    mismatches (the pigeonhole principle). Each piece is used as a seed: the
+    k-mer at the start of the piece is looked up in the index, giving
+    candidate starting positions for the read. Each candidate is then
+    extended by counting mismatches across the whole read, stopping as soon
+    as there are more than m.
+
+    Attributes:
+    -----------
+    reference : str
+        the reference sequence
+    k : int
+        the length of the seeds stored in the index
+    index : dict
+        the positions of each seed. Keys are strings, values are lists.
+    mismatches : int
+        the largest number of mismatches allowed
+
+    Methods:
+    --------
+    candidates(read)
+        returns a sorted list of possible starting positions of the read
+    count_mismatches(read,start)
+        returns the number of mismatches with the reference at a position
+    align(read)
+        returns a tuple with the first and second alignment positions and
+        the number of mismatches at each
+    """
+
+    def __init__(self,reference,mismatches,k=12,indexFile=None):
+        """
+        Constructs an aligner for the given reference sequence, allowing
+        the given number of mismatches.
+        """
+        KmerAligner.__init__(self,reference,k,indexFile)
+        if mismatches < 0:
+            raise RuntimeError("Number of mismatches must not be negative")
+        self.mismatches = mismatches
+
+    def candidates(self,read):
+        """
+        Finds the possible starting positions of a read from its seeds.
+
+        The read is split into mismatches+1 pieces as evenly as possible.
+        If the pieces are shorter than k, they cannot be looked up in the
+        index, so every position in the reference is a candidate.
+        """
+        readLen = len(read)
+        lastStart = len(self.reference) - readLen
+        nPieces = self.mismatches + 1
+        if readLen // nPieces < self.k:
+            return range(lastStart + 1)
+        found = set()
+        for piece in range(nPieces):
+            offset = piece * readLen // nPieces
+            for position in self.index.get(read[offset:offset+self.k],[]):
+                start = position - offset
+                if start >= 0 and start <= lastStart:
+                    found.add(start)
+        return sorted(found)
+
+    def count_mismatches(self,read,start):
+        """
+        Counts the mismatches between a read and the reference starting at a
+        given position, stopping once there are more than allowed.
+        """
+        count = 0
+        reference = self.reference
+        for i, base in enumerate(read):
+            if reference[start+i] != base:
+                count += 1
+                if count > self.mismatches:
+                    break
+        return count
+
+    def align(self,read):
+        """
+        Finds the first two positions where the read appears in the reference
+        with at most the allowed number of mismatches.
+
+        Returns a tuple with the two positions (-1 if not found) followed by
+        the number of mismatches at each (-1 if not found).
+        """
+        found = []
+        counts = []
+        for start in self.candidates(read):
+            count = self.count_mismatches(read,start)
+            if count <= self.mismatches:
+                found.append(start)
+                counts.append(count)
+                if len(found) == 2:
+                    break
+        while len(found) < 2:
+            found.append(-1)
+            counts.append(-1)
+        return (found[0],found[1],counts[0],counts[1])
+
+
+class AhoCorasickAligner(FindAligner):
+    """
+    AhoCorasickAligner: aligns many reads in a single pass over the reference.
+
+    Rather than searching the reference once for each read, this builds an
+    Aho-Corasick automaton from all of the reads in a batch: a trie of the
+    reads, where each node also has a failure link to the node for the
+    longest suffix of its string that is also in the trie. Stepping through
+    the reference one base at a time then finds every read that ends at each
+    position, so the cost of a batch is about the length of the reference
+    plus the total length of the reads, rather than their product. Each
+    batch needs its own pass over the reference, so the total cost grows
+    with the reference length times the number of batches. processdata.py
+    uses larger batches for this engine to keep the passes few, at the cost
+    of the memory taken by the automaton.
+
+    Attributes:
+    -----------
+    reference : str
+        the reference sequence
+
+    Methods:
+    --------
+    build_automaton(reads)
+        returns the transitions, failure links, and outputs of an automaton
+    align(read)
+        returns a tuple with the first and second alignment positions
+    align_all(reads)
+        returns a list with the alignment positions of each read
+    """
+
+    def build_automaton(self,reads):
+        """
+        Builds the automaton for a list of distinct, non-empty reads.
+
+        Nodes are numbered from 0 (the root). Returns three lists indexed by
+        node: a dictionary of the transitions from each node, the node's
+        output (the index of the read ending there, or -1), and the next node
+        along the failure links that has an output (or 0 if none does).
+        """
+        goto = [dict()]
+        output = [-1]
+        for r, read in enumerate(reads):
+            node = 0
+            for base in read:
+                child = goto[node].get(base)
+                if child is None:
+                    child = len(goto)
+                    goto[node][base] = child
+                    goto.append(dict())
+                    output.append(-1)
+                node = child
+            output[node] = r
+        # Find the failure links in breadth-first order, so that the link of
+        # a node's parent is always known before the node's own link.
+        fail = [0] * len(goto)
+        outLink = [0] * len(goto)
+        queue = collections.deque(goto[0].values())
+        while len(queue) > 0:
+            node = queue.popleft()
+            for base, child in goto[node].items():
+                # Children of the root link back to the root. Otherwise,
+                # follow the parent's failure links until a node with a
+                # transition on the same base is found.
+                link = 0
+                if node != 0:
+                    link = fail[node]
+                    while link != 0 and base not in goto[link]:
+                        link = fail[link]
+                    link = goto[link].get(base,0)
+                fail[child] = link
+                if output[link] >= 0:
+                    outLink[child] = link
+                else:
+                    outLink[child] = outLink[link]
+                queue.append(child)
+        return (goto,fail,output,outLink)
+
+    def align(self,read):
+        """
+        Finds the first two positions where the read appears in the reference.
+        """
+        return self.align_all([read])[0]
+
+    def align_all(self,reads):
+        """
+        Aligns a list of reads with one pass over the reference.
+
+        Matches are found in order of where they end, and all copies of a
+        read have the same length, so the first two matches found for a
+        read are its first two positions. The pass stops early once every
+        read has been found twice. Empty reads are aligned with find.
+        """
+        patterns = []
+        patternIndex = dict()
+        for read in reads:
+            if len(read) > 0 and read not in patternIndex:
+                patternIndex[read] = len(patterns)
+                patterns.append(read)
+        found = [[] for read in patterns]
+        if len(patterns) > 0:
+            (goto,fail,output,outLink) = self.build_automaton(patterns)
+            remaining = len(patterns)
+            node = 0
+            for i, base in enumerate(self.reference):
+                while node != 0 and base not in goto[node]:
+                    node = fail[node]
+                node = goto[node].get(base,0)
+                # Visit every read ending at this position
+                if output[node] >= 0:
+                    match = node
+                else:
+                    match = outLink[node]
+                while match != 0:
+                    hits = found[output[match]]
+                    if len(hits) < 2:
+                        hits.append(i - len(patterns[output[match]]) + 1)
+                        if len(hits) == 2:
+                            remaining -= 1
+                    match = outLink[match]
+                if remaining == 0:
+                    break
+        results = []
+        for read in reads:
+            if len(read) == 0:
+                results.append(FindAligner.align(self,read))
+                continue
+            hits = found[patternIndex[read]]
+            results.append((hits[0] if len(hits) > 0 else -1,
+                            hits[1] if len(hits) > 1 else -1))
+        return results
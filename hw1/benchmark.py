@@ -0,0 +1,265 @@
+"""
+This program measures how the alignment engines in processdata.py scale with
+the reference length, number of reads, and read length.
+
+For each point of a grid of <ref_length> <nreads> <read_len> values, a
+dataset is made with generatedata.py (so 75% of the reads align once, 10%
+align twice, and 15% do not align), and processdata.py is run on it with
+each engine, or with each mode: an engine followed by other options of
+processdata.py, such as "kmer --workers 4". The wall time, alignment time,
+reads per second, and peak memory (RSS) of each run are recorded, along with
+whether the aligns 0/1/2 fractions agree with the generated data and whether
+every run wrote the same alignment file as the first run with the same
+number of mismatches (which changes the format of the file). The results
+are written to a JSON or CSV report, which can be compared to an earlier
+report to catch slowdowns.
+"""
+
+# Import useful modules
+import csv
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+# Default grid of (reference length, number of reads, read length)
+DEFAULT_GRID = [(10000,6000,50),(100000,6000,50),(100000,60000,50),
+                (100000,60000,100),(1000000,60000,50)]
+DEFAULT_ENGINES = ['find','kmer','sa','ac','packed']
+# Largest difference allowed between a measured aligns fraction and the
+# generated one. They can differ slightly when a random read happens to
+# appear in the reference.
+FRACTION_TOLERANCE = 0.01
+# Fields of each record, in the order they are written to a CSV report
+FIELDS = ['ref_length','nreads','read_len','engine','mode','wall_time',
+          'align_time','reads_per_second','peak_rss_kb','aligns_0',
+          'aligns_1','aligns_2','fractions_ok','output_matches']
+
+# Directory containing this program, generatedata.py, and processdata.py
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Function to run a program, returning its output, the wall time taken, and
+# its peak memory use in kilobytes.
+# The program is waited for with wait4, which gives the resource use of that
+# process alone, so its output goes to temporary files rather than pipes.
+def run(args):
+    with tempfile.TemporaryFile('w+') as out, tempfile.TemporaryFile('w+') as err:
+        start = time.time()
+        process = subprocess.Popen([sys.executable] + args,stdout=out,
+                                   stderr=err,universal_newlines=True)
+        (pid,status,usage) = os.wait4(process.pid,0)
+        wallTime = time.time() - start
+        process.returncode = os.waitstatus_to_exitcode(status)
+        out.seek(0)
+        err.seek(0)
+        if process.returncode != 0:
+            message = "{} failed: {}".format(" ".join(args),err.read().strip())
+            raise RuntimeError(message)
+        return (out.read(),wallTime,usage.ru_maxrss)
+
+# Function to read the "name: value" lines printed by generatedata.py and
+# processdata.py into a dictionary
+def parse_output(out):
+    values = dict()
+    for line in out.splitlines():
+        if ":" in line:
+            (name,value) = line.split(":",1)
+            values[name.strip()] = value.strip()
+    return values
+
+# Function to hash a file, used to check that engines agree
+def file_hash(fileName):
+    h = hashlib.sha1()
+    with open(fileName,'rb') as f:
+        for block in iter(lambda: f.read(1 << 20),b""):
+            h.update(block)
+    return h.hexdigest()
+
+# Function to run processdata.py in every mode on one dataset and return a
+# list of records. Each mode is a string holding an engine followed by any
+# other options of processdata.py.
+def benchmark_point(refLength,nReads,readLen,modes,workdir,seed):
+    name = "{}_{}_{}".format(refLength,nReads,readLen)
+    refFile = os.path.join(workdir,"ref_" + name + ".txt")
+    readsFile = os.path.join(workdir,"reads_" + name + ".txt")
+    (out,wallTime,peakRss) = run([os.path.join(SCRIPT_DIR,"generatedata.py"),
+                                  str(refLength),str(nReads),str(readLen),
+                                  refFile,readsFile,"--seed",str(seed)])
+    expected = parse_output(out)
+    records = []
+    # Hash of the first alignment file written with each number of
+    # mismatches
+    firstHashes = dict()
+    for (m,mode) in enumerate(modes):
+        words = mode.split()
+        engine = words[0]
+        extraArgs = words[1:]
+        alignFile = os.path.join(workdir,"align_{}_{}.txt".format(name,m))
+        args = [os.path.join(SCRIPT_DIR,"processdata.py"),refFile,readsFile,
+                alignFile,"--engine",engine] + extraArgs
+        if engine == 'sa' and "--index" not in extraArgs:
+            args += ["--index",os.path.join(workdir,"ref_" + name + ".sa")]
+        mismatches = "0"
+        if "--mismatches" in extraArgs[:-1]:
+            mismatches = extraArgs[extraArgs.index("--mismatches") + 1]
+        (out,wallTime,peakRss) = run(args)
+        result = parse_output(out)
+        alignTime = float(result['elapsed time'])
+        fractionsOk = True
+        for i in range(3):
+            key = "aligns {}".format(i)
+            if abs(float(result[key]) - float(expected[key])) > FRACTION_TOLERANCE:
+                fractionsOk = False
+        alignHash = file_hash(alignFile)
+        firstHash = firstHashes.setdefault(mismatches,alignHash)
+        os.remove(alignFile)
+        records.append({'ref_length': refLength,
+                        'nreads': nReads,
+                        'read_len': readLen,
+                        'engine': engine,
+                        'mode': mode,
+                        'wall_time': wallTime,
+                        'align_time': alignTime,
+                        'reads_per_second': nReads / max(alignTime,1e-9),
+                        'peak_rss_kb': peakRss,
+                        'aligns_0': float(result['aligns 0']),
+                        'aligns_1': float(result['aligns 1']),
+                        'aligns_2': float(result['aligns 2']),
+                        'fractions_ok': fractionsOk,
+                        'output_matches': alignHash == firstHash})
+    return records
+
+# Function to write a list of records as JSON or CSV, depending on the
+# file name
+def write_report(fileName,records):
+    if fileName.endswith(".csv"):
+        with open(fileName,'w',newline='') as f:
+            writer = csv.DictWriter(f,fieldnames=FIELDS)
+            writer.writeheader()
+            writer.writerows(records)
+    else:
+        with open(fileName,'w') as f:
+            json.dump({'records': records},f,indent=2)
+
+# Function to read a report written by write_report
+def read_report(fileName):
+    if fileName.endswith(".csv"):
+        with open(fileName,'r',newline='') as f:
+            records = list(csv.DictReader(f))
+        for record in records:
+            for field in ['ref_length','nreads','read_len','peak_rss_kb']:
+                record[field] = int(record[field])
+            for field in ['wall_time','align_time','reads_per_second']:
+                record[field] = float(record[field])
+    else:
+        with open(fileName,'r') as f:
+            records = json.load(f)['records']
+    # Reports written before modes were added ran each engine alone
+    for record in records:
+        if not record.get('mode'):
+            record['mode'] = record['engine']
+    return records
+
+# Function to compare records to a baseline report. A run is a regression if
+# its alignment time is more than tolerance times the baseline's, or its
+# peak memory is more than tolerance times the baseline's.
+# Returns a list of messages describing each regression.
+def compare(records,baseline,tolerance):
+    key = lambda r: (r['ref_length'],r['nreads'],r['read_len'],r['mode'])
+    previous = dict((key(r),r) for r in baseline)
+    regressions = []
+    for record in records:
+        old = previous.get(key(record))
+        if old is None:
+            continue
+        label = "{} {}:{}:{}".format(record['mode'],record['ref_length'],
+                                     record['nreads'],record['read_len'])
+        if record['align_time'] > tolerance * old['align_time']:
+            message = "{}: align time {:.4f} s (baseline {:.4f} s)"
+            regressions.append(message.format(label,record['align_time'],
+                                              old['align_time']))
+        if record['peak_rss_kb'] > tolerance * old['peak_rss_kb']:
+            message = "{}: peak RSS {} kB (baseline {} kB)"
+            regressions.append(message.format(label,record['peak_rss_kb'],
+                                              old['peak_rss_kb']))
+    return regressions
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage:")
+        print("  $ python3 benchmark.py <report_file (.json or .csv)> [options]")
+        print("Options:")
+        print("  --grid <r:n:l,...>       datasets to generate, as <ref_length>:<nreads>:<read_len>")
+        print("  --engines <e1,e2,...>    engines to run (default = {})".format(",".join(DEFAULT_ENGINES)))
+        print("  --mode <\"engine opts\">  an engine and other processdata.py options to run,")
+        print("                           e.g. --mode \"kmer --workers 4\"; may be repeated,")
+        print("                           and replaces --engines when given")
+        print("  --baseline <report>      earlier report to compare against")
+        print("  --tolerance <factor>     slowdown allowed before a regression is reported (default = 1.25)")
+        print("  --seed <seed>            seed for generatedata.py (default = 0)")
+        print("  --workdir <dir>          directory for the generated data (default = temporary)")
+        sys.exit(0)
+    reportFile = sys.argv[1]
+    options = {'grid': None, 'engines': ",".join(DEFAULT_ENGINES),
+               'baseline': None, 'tolerance': '1.25', 'seed': '0',
+               'workdir': None}
+    modes = []
+    optionArgs = sys.argv[2:]
+    if len(optionArgs) % 2 != 0:
+        print("ERROR: option {} has no value".format(optionArgs[-1]))
+        sys.exit(2)
+    for i in range(0,len(optionArgs),2):
+        name = optionArgs[i][2:]
+        if optionArgs[i] == "--mode":
+            # Modes may be given more than once, so they are kept in a list
+            if len(optionArgs[i+1].split()) == 0:
+                print("ERROR: empty mode")
+                sys.exit(2)
+            modes.append(optionArgs[i+1])
+            continue
+        if not optionArgs[i].startswith("--") or name not in options:
+            print("ERROR: unknown option {}".format(optionArgs[i]))
+            sys.exit(2)
+        options[name] = optionArgs[i+1]
+    grid = DEFAULT_GRID
+    if options['grid'] is not None:
+        grid = [tuple(int(v) for v in point.split(":"))
+                for point in options['grid'].split(",")]
+    if len(modes) == 0:
+        modes = options['engines'].split(",")
+    workdir = options['workdir']
+    if workdir is None:
+        tempdir = tempfile.TemporaryDirectory()
+        workdir = tempdir.name
+    else:
+        os.makedirs(workdir,exist_ok=True)
+
+    records = []
+    for (refLength,nReads,readLen) in grid:
+        pointRecords = benchmark_point(refLength,nReads,readLen,modes,
+                                       workdir,int(options['seed']))
+        for r in pointRecords:
+            form = "{:>8} {:>9} {:>5} {:<24}  {:9.4f} s  {:12.0f} reads/s  {:9d} kB  {}"
+            status = "ok" if r['fractions_ok'] and r['output_matches'] else "MISMATCH"
+            print(form.format(r['ref_length'],r['nreads'],r['read_len'],
+                              r['mode'],r['align_time'],
+                              r['reads_per_second'],r['peak_rss_kb'],status))
+        records.extend(pointRecords)
+    write_report(reportFile,records)
+
+    failed = False
+    for r in records:
+        if not (r['fractions_ok'] and r['output_matches']):
+            failed = True
+    if options['baseline'] is not None:
+        baseline = read_report(options['baseline'])
+        regressions = compare(records,baseline,float(options['tolerance']))
+        for message in regressions:
+            print("REGRESSION: " + message)
+        if len(regressions) > 0:
+            failed = True
+    if failed:
+        sys.exit(1)
@@ -1,10 +1,68 @@
 import sys
-import random
+
+import numpy as np
+
+import packedseq
+
+# Number of bases or reads generated and written at a time, so that output is
+# streamed to the files rather than built up in memory first.
+CHUNK_BASES = 1 << 24
+CHUNK_READS = 1 << 20
+# Largest k-mer length used by the index of reference k-mers. The index has
+# one bit for each of the 4^k possible k-mers, so k = 16 takes 512 MB.
+MAX_INDEX_K = 16
+
+# Function to get the bases at an array of reference positions.
+# Only the randomly-generated part of the reference is stored, since the last
+# part of the reference is a copy of the end of it.
+def ref_codes(randomCodes,copyLength,positions):
+    randLength = len(randomCodes)
+    return randomCodes[np.where(positions < randLength,positions,
+                                positions - copyLength)]
+
+# Function to build an index of which k-mers appear in the reference.
+# The index is a bitmap with one bit per possible k-mer (using the 2-bit
+# codes of packedseq.py, with the first base in the highest bits). The k-mer
+# length is the smallest for which at most about 1/8 of the bits are set,
+# unless that is longer than the reads or MAX_INDEX_K.
+def build_kmer_index(randomCodes,copyLength,readLen):
+    refLength = len(randomCodes) + copyLength
+    k = 1
+    while k < min(readLen,MAX_INDEX_K) and 4**k < 8 * refLength:
+        k += 1
+    bitmap = np.zeros((4**k + 7) // 8,dtype=np.uint8)
+    nKmers = refLength - k + 1
+    for start in range(0,max(nKmers,0),CHUNK_BASES):
+        stop = min(start + CHUNK_BASES,nKmers)
+        codes = ref_codes(randomCodes,copyLength,
+                          np.arange(start,stop + k - 1,dtype=np.int64))
+        kmers = packedseq.PackedAligner.kmer_codes(codes,k)
+        np.bitwise_or.at(bitmap,kmers >> np.uint64(3),
+                         np.left_shift(1,kmers & np.uint64(7)).astype(np.uint8))
+    return (k,bitmap)
+
+# Function to check which of a set of reads (a 2D array of codes, one read
+# per row) certainly do not appear in the reference.
+# A read cannot appear if any of its k-mers is missing from the index. When
+# the reads are no longer than k this is exact; otherwise a read with all of
+# its k-mers in the reference is treated as present, even though it might
+# not be.
+def absent_reads(reads,k,bitmap):
+    nWindows = reads.shape[1] - k + 1
+    kmers = np.zeros((reads.shape[0],nWindows),dtype=np.uint64)
+    for j in range(k):
+        kmers <<= np.uint64(2)
+        kmers |= reads[:,j:j+nWindows].astype(np.uint64)
+    present = (bitmap[kmers >> np.uint64(3)] >> (kmers & np.uint64(7))) & 1
+    return np.any(present == 0,axis=1)
+
 if __name__ == "__main__":
     if len(sys.argv) <= 5:
         # Not enough arguments, print usage message
         print("Usage:")
-        print("  $ python3 generatedata.py <ref_length> <nreads> <read_len> <ref_file> <reads_file>")
+        print("  $ python3 generatedata.py <ref_length> <nreads> <read_len> <ref_file> <reads_file> [--seed <seed>]")
+        print("Files with names ending in .packed are written in the packed format (see packedseq.py).")
+        print("Giving a seed makes the data the same each time it is generated.")
         sys.exit(0)
     # Assign inputs to variables, including converting strings to numbers if necessary
     refLength = int(sys.argv[1])
@@ -12,21 +70,42 @@ if __name__ == "__main__":
     readLen = int(sys.argv[3])
     refFile = sys.argv[4]
     readsFile = sys.argv[5]
-    # Set up converstion from random number to DNA base by creating a list with the available bases
-    baseAssign = ['A','C','G','T']
+    seed = None
+    if len(sys.argv) > 6:
+        if sys.argv[6] != "--seed" or len(sys.argv) != 8:
+            print("ERROR: unknown option {}".format(" ".join(sys.argv[6:])))
+            sys.exit(2)
+        seed = int(sys.argv[7])
+    rng = np.random.default_rng(seed)
+    # Set up converstion from random number to DNA base by using the codes
+    # from packedseq.py (0 to 3 for A, C, G, T)
+    baseAssign = packedseq.BASES
     # Number of randomly-assigned and copied base pairs in reference file.
     # Subtraction is used for to determine the number of copied pairs to avoid issues created by rounding down if refLength is not a multiple of four
     randLength = int(0.75 * refLength)
     copyLength = refLength - randLength
-    # A random integer from 0 to 3 is chosen, and then the letter in the corresponding position in baseAssign is written to the end of a list
-    randomList = []
-    for i in range(randLength):
-        randomList.append(baseAssign[random.randint(0,3)])
-    randomText = "".join(randomList)
-    copyText = randomText[-copyLength:]
-    refText = randomText + copyText
-    with open(refFile,'w') as f1:
-        f1.write(refText)
+    # Every read is readLen bases long, and the reads that align twice come
+    # from the copied quarter, so they must fit in it. (Reads that align once
+    # come from the first half, and must not run past the end.)
+    if readLen < 1 or readLen > copyLength:
+        print("ERROR: read length must be from 1 to {} (a quarter of the "
+              "reference length)".format(copyLength))
+        sys.exit(2)
+    # The random part of the reference is drawn all at once, as an array of
+    # codes from 0 to 3. The reference is then written in chunks: first the
+    # random part, then the copy of its last copyLength bases.
+    randomCodes = rng.integers(0,4,randLength,dtype=np.uint8)
+    if refFile.endswith(".packed"):
+        f1 = packedseq.PackedWriter(refFile,1,refLength)
+        writeRef = f1.write
+    else:
+        f1 = open(refFile,'wb')
+        writeRef = lambda codes: f1.write(baseAssign[codes].tobytes())
+    for start in range(0,refLength,CHUNK_BASES):
+        stop = min(start + CHUNK_BASES,refLength)
+        writeRef(ref_codes(randomCodes,copyLength,
+                           np.arange(start,stop,dtype=np.int64)))
+    f1.close()
     # Generate reads
     # Determine the length of the reference sequence made of unique reads
     uniqueLength = int(0.5 * refLength)
@@ -35,45 +114,51 @@ if __name__ == "__main__":
     align0 = 0.0
     align1 = 0.0
     align2 = 0.0
-    # As each read is generated, append it to a list
-    readsList = []
-    for i in range(nReads):
-        rand = random.random()
-        if rand < 0.75:
-            # 75% of the time, pick a random position in the first (unique) half and generate a read of the required length from there
-            # Add a line break at the end and increase the count of single-aligned reads
-            readStart = random.randint(0,uniqueLength-1)
-            readEnd = readStart + readLen
-            readsList.append(refText[readStart:readEnd]+"\n")
-            align1 = align1 + 1
-        elif rand < 0.85:
-            # 10% of the time, pick a random position in the last (doubled) quarter and generate a read of the required length from there
-            # Add a line break at the end and increase the count of single-aligned reads
-            readStart = random.randint(randLength,(refLength-readLen))
-            readEnd = readStart + readLen
-            readsList.append(refText[readStart:readEnd]+"\n")
-            align2 = align2 + 1
-        else:
-            # 15% of the time, randomly generate new reads until one not in the reference is found.
-            # Use a while loop, since a new read must be repeatedly generated until it does not appear in the reference.
-            # Each read is constructed by generating a list of random bases, then joining the list to form a string.
-            # The position of the possible read is found in the reference sequence.
-            # If the proposed read is not found, the find function returns -1, and the loop is exited with the unique read
-            found = 0
-            str = ""
-            readStr = ""
-            while found >= 0:
-                readList = []
-                for i in range(readLen):
-                    readList.append(baseAssign[random.randint(0,3)])
-                readStr = str.join(readList)
-                found = refText.find(readStr)
-            readsList.append(readStr+"\n")
-            align0 = align0 + 1
-    # Convert readsList to a string and write the string to readsFile
-    readsString = "".join(readsList)
-    with open(readsFile,'w') as f2:
-        f2.write(readsString)
+    # Reads that should not align are checked against an index of the
+    # k-mers in the reference instead of searching the reference itself
+    (k,bitmap) = build_kmer_index(randomCodes,copyLength,readLen)
+    if readsFile.endswith(".packed"):
+        f2 = packedseq.PackedWriter(readsFile,nReads,readLen)
+        writeReads = lambda reads: f2.write(reads.ravel())
+    else:
+        f2 = open(readsFile,'wb')
+        newlines = np.full((1,1),ord("\n"),dtype=np.uint8)
+        def writeReads(reads):
+            text = np.hstack([baseAssign[reads],
+                              np.repeat(newlines,len(reads),axis=0)])
+            f2.write(text.tobytes())
+    offsets = np.arange(readLen,dtype=np.int64)
+    for first in range(0,nReads,CHUNK_READS):
+        nChunk = min(CHUNK_READS,nReads - first)
+        reads = np.zeros((nChunk,readLen),dtype=np.uint8)
+        rand = rng.random(nChunk)
+        # 75% of the time, pick a random position in the first (unique) half and generate a read of the required length from there
+        single = np.nonzero(rand < 0.75)[0]
+        readStart = rng.integers(0,uniqueLength,len(single))
+        reads[single] = ref_codes(randomCodes,copyLength,
+                                  readStart[:,None] + offsets)
+        align1 = align1 + len(single)
+        # 10% of the time, pick a random position in the last (doubled) quarter and generate a read of the required length from there
+        double = np.nonzero((rand >= 0.75) & (rand < 0.85))[0]
+        readStart = rng.integers(randLength,refLength - readLen + 1,len(double))
+        reads[double] = ref_codes(randomCodes,copyLength,
+                                  readStart[:,None] + offsets)
+        align2 = align2 + len(double)
+        # 15% of the time, randomly generate new reads until one not in the reference is found.
+        # All of these reads are generated at once, and any that might be in
+        # the reference are generated again until none are left.
+        missing = np.nonzero(rand >= 0.85)[0]
+        align0 = align0 + len(missing)
+        tries = 0
+        while len(missing) > 0:
+            reads[missing] = rng.integers(0,4,(len(missing),readLen),
+                                          dtype=np.uint8)
+            missing = missing[~absent_reads(reads[missing],k,bitmap)]
+            tries += 1
+            if tries == 1000:
+                raise RuntimeError("Unable to find reads that are not in the reference")
+        writeReads(reads)
+    f2.close()
     # Print required outputs
     print("reference length: {}".format(refLength))
     print("number reads: {}".format(nReads))
@@ -0,0 +1,503 @@
+"""
+This module contains a compact 2-bit encoding for DNA sequences, along with
+an aligner that works directly on the encoded reference.
+
+Each base is stored in 2 bits (A = 0, C = 1, G = 2, T = 3), four bases to a
+byte, so a sequence takes a quarter of the memory of a text file and an
+eighth of a Python string. A packed file holds a number of sequences of the
+same length (one for a reference, one per read for a reads file) stored one
+after the other, after a short header. The file can be memory-mapped, so
+large references are never read into memory all at once. generatedata.py
+writes files in this format when their names end in '.packed', and
+processdata.py recognizes packed files by their header.
+
+Usage:
+  $ python3 packedseq.py <text_file> <packed_file>
+converts a reference or reads file to the packed format, and
+  $ python3 packedseq.py --unpack <packed_file> <text_file>
+converts it back.
+"""
+
+# Import useful modules
+import struct
+import sys
+
+import numpy as np
+
+# Layout of the header at the start of a packed file: a magic string,
+# followed by the number of sequences and the length of each sequence.
+MAGIC = b"HW1PK\x00\x00\x01"
+HEADER = struct.Struct("<8s2Q")
+
+# Conversions between bases and 2-bit codes. Letters other than the four
+# bases map to 255 so that they can be detected.
+BASES = np.frombuffer(b"ACGT",dtype=np.uint8)
+CODES = np.full(256,255,dtype=np.uint8)
+CODES[BASES] = np.arange(4,dtype=np.uint8)
+
+def encode(text):
+    """
+    Converts a string or bytes of bases to a numpy array of 2-bit codes,
+    one code per element.
+    """
+    if isinstance(text,str):
+        text = text.encode()
+    codes = CODES[np.frombuffer(text,dtype=np.uint8)]
+    if np.any(codes == 255):
+        raise RuntimeError("Sequence contains letters other than A, C, G, T")
+    return codes
+
+def decode(codes):
+    """
+    Converts an array of 2-bit codes back to a string of bases.
+    """
+    return BASES[codes].tobytes().decode()
+
+def pack(codes):
+    """
+    Packs an array of 2-bit codes four to a byte, with the first base of
+    each group of four in the lowest two bits.
+    """
+    padded = np.zeros(4 * ((len(codes) + 3) // 4),dtype=np.uint8)
+    padded[:len(codes)] = codes
+    groups = padded.reshape(-1,4)
+    return (groups[:,0] | (groups[:,1] << 2) | (groups[:,2] << 4)
+            | (groups[:,3] << 6)).astype(np.uint8)
+
+def unpack(packed,start,stop):
+    """
+    Returns the 2-bit codes of positions start to stop (exclusive) from an
+    array of packed bytes.
+    """
+    positions = np.arange(start,stop,dtype=np.int64)
+    return gather(packed,positions)
+
+def gather(packed,positions):
+    """
+    Returns the 2-bit codes at an array of positions (of any shape) from an
+    array of packed bytes.
+    """
+    shifts = ((positions & 3) << 1).astype(np.uint8)
+    return (packed[positions >> 2] >> shifts) & 3
+
+def is_packed(fileName):
+    """
+    Checks whether a file is in the packed format.
+    """
+    with open(fileName,'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+def write_packed(fileName,codes,count=1):
+    """
+    Writes an array of 2-bit codes to a packed file, as count sequences of
+    equal length.
+    """
+    if count > 0 and len(codes) % count != 0:
+        raise RuntimeError("Sequences must all have the same length")
+    length = len(codes) // count if count > 0 else 0
+    with open(fileName,'wb') as f:
+        f.write(HEADER.pack(MAGIC,count,length))
+        f.write(pack(codes).tobytes())
+
+class PackedWriter:
+    """
+    PackedWriter: writes a packed file a piece at a time.
+
+    Codes can be written in pieces of any length; up to three codes left
+    over from a piece are held until the next one, so that the file is the
+    same as if all the codes had been packed at once.
+
+    Attributes:
+    -----------
+    f : file
+        the file being written
+    leftover : numpy array, data type uint8
+        the codes not yet written, fewer than four
+
+    Methods:
+    --------
+    write(codes)
+        packs and writes an array of 2-bit codes
+    close()
+        writes any remaining codes and closes the file
+    """
+
+    def __init__(self,fileName,count,length):
+        """
+        Opens a packed file for count sequences of the given length.
+        """
+        self.f = open(fileName,'wb')
+        self.f.write(HEADER.pack(MAGIC,count,length))
+        self.leftover = np.zeros(0,dtype=np.uint8)
+
+    def write(self,codes):
+        """
+        Packs and writes an array of 2-bit codes.
+        """
+        if len(self.leftover) > 0:
+            codes = np.concatenate([self.leftover,codes])
+        nWhole = 4 * (len(codes) // 4)
+        self.f.write(pack(codes[:nWhole]).tobytes())
+        self.leftover = np.array(codes[nWhole:],dtype=np.uint8)
+
+    def close(self):
+        """
+        Writes any remaining codes and closes the file.
+        """
+        self.f.write(pack(self.leftover).tobytes())
+        self.f.close()
+
+
+class PackedSequence:
+    """
+    PackedSequence: a set of equal-length DNA sequences stored 2 bits per base.
+
+    Attributes:
+    -----------
+    packed : numpy array, data type uint8
+        the bases of all the sequences, four to a byte. This is a memory-map
+        when the sequences are read from a file.
+    count : int
+        the number of sequences
+    length : int
+        the number of bases in each sequence
+
+    Methods:
+    --------
+    codes(start,stop)
+        returns the 2-bit codes of a range of bases
+    sequence(i)
+        returns sequence i as a string
+    sequences(first,last)
+        returns a list of sequences first to last (exclusive) as strings
+    """
+
+    def __init__(self,packed,count,length):
+        """
+        Constructs a set of sequences from an array of packed bytes.
+        """
+        self.packed = packed
+        self.count = count
+        self.length = length
+
+    def __len__(self):
+        """
+        Returns the total number of bases.
+        """
+        return self.count * self.length
+
+    @classmethod
+    def from_file(cls,fileName):
+        """
+        Opens a packed file, memory-mapping its contents.
+        """
+        with open(fileName,'rb') as f:
+            header = f.read(HEADER.size)
+        if len(header) < HEADER.size:
+            raise RuntimeError("{} is not a packed file".format(fileName))
+        (magic,count,length) = HEADER.unpack(header)
+        if magic != MAGIC:
+            raise RuntimeError("{} is not a packed file".format(fileName))
+        nBytes = (count * length + 3) // 4
+        if nBytes == 0:
+            return cls(np.zeros(0,dtype=np.uint8),count,length)
+        packed = np.memmap(fileName,dtype=np.uint8,mode='r',
+                           offset=HEADER.size,shape=(nBytes,))
+        return cls(packed,count,length)
+
+    @classmethod
+    def from_text(cls,text):
+        """
+        Constructs a single packed sequence from a string of bases.
+        """
+        codes = encode(text)
+        return cls(pack(codes),1,len(codes))
+
+    def codes(self,start,stop):
+        """
+        Returns the 2-bit codes of bases start to stop (exclusive), counting
+        from the start of the first sequence.
+        """
+        return unpack(self.packed,start,stop)
+
+    def sequence(self,i):
+        """
+        Returns sequence i as a string.
+        """
+        return decode(self.codes(i * self.length,(i + 1) * self.length))
+
+    def sequences(self,first,last):
+        """
+        Returns sequences first to last (exclusive) as a list of strings.
+        """
+        text = decode(self.codes(first * self.length,last * self.length))
+        length = self.length
+        return [text[i:i+length] for i in range(0,len(text),length)]
+
+
+class PackedAligner:
+    """
+    PackedAligner: aligns reads against a 2-bit packed reference.
+
+    This works like the k-mer aligner, but both the reference and the index
+    are kept in numpy arrays instead of Python strings, lists, and
+    dictionaries. Every k-mer (k at most 32) is converted to a 64-bit
+    integer code, and the positions of the reference are sorted by the code
+    of the k-mer starting there. The positions with a given k-mer then form
+    a range that is found with a binary search. Candidate positions are
+    checked by comparing codes taken straight from the packed reference.
+
+    Attributes:
+    -----------
+    ref : PackedSequence
+        the reference sequence
+    k : int
+        the length of the k-mers in the index
+    kmers : numpy array, data type uint64
+        the code of each indexed k-mer, in sorted order
+    positions : numpy array, data type uint32 or int64
+        the position of each indexed k-mer, in the same order as kmers
+
+    Methods:
+    --------
+    build_index()
+        returns the sorted k-mer codes and their positions
+    kmer_codes(codes,k)
+        returns the code of every k-mer in an array of 2-bit codes
+    lookup(codes)
+        returns the positions where a sequence of at most k codes starts
+    align(read)
+        returns a tuple with the first and second alignment positions
+    align_all(reads)
+        returns a list with the alignment positions of each read
+    """
+
+    def __init__(self,ref,k=12):
+        """
+        Constructs an aligner for a packed reference sequence.
+        """
+        if k < 1 or k > 32:
+            raise RuntimeError("k-mer length must be from 1 to 32")
+        self.ref = ref
+        self.k = k
+        (self.kmers,self.positions) = self.build_index()
+
+    def __len__(self):
+        """
+        Returns the length of the reference sequence.
+        """
+        return len(self.ref)
+
+    @staticmethod
+    def kmer_codes(codes,k):
+        """
+        Returns the 64-bit code of each k-mer in an array of 2-bit codes,
+        with the first base in the highest bits.
+        """
+        n = len(codes) - k + 1
+        kmers = np.zeros(max(n,0),dtype=np.uint64)
+        for j in range(k):
+            kmers <<= np.uint64(2)
+            kmers |= codes[j:j+n].astype(np.uint64)
+        return kmers
+
+    def build_index(self,blockSize=1<<24):
+        """
+        Sorts the positions of the reference by the code of the k-mer
+        starting at each one.
+
+        The reference is unpacked one block at a time, so only the index
+        and one block of codes are in memory at once. A stable sort keeps
+        the positions of each k-mer in increasing order.
+        """
+        n = len(self.ref)
+        nKmers = max(n - self.k + 1,0)
+        kmers = np.zeros(nKmers,dtype=np.uint64)
+        for start in range(0,nKmers,blockSize):
+            stop = min(start + blockSize,nKmers)
+            codes = self.ref.codes(start,stop + self.k - 1)
+            kmers[start:stop] = self.kmer_codes(codes,self.k)
+        positionType = np.uint32 if n < 2**32 else np.int64
+        order = np.argsort(kmers,kind='stable')
+        return (kmers[order],order.astype(positionType))
+
+    def lookup(self,codes):
+        """
+        Finds where a sequence of codes no longer than k starts in the
+        reference, returning a sorted array of positions.
+
+        All k-mers beginning with the sequence form one range of the sorted
+        index. Positions in the last k-1 bases of the reference have no
+        k-mer in the index, so they are checked directly.
+        """
+        k = self.k
+        length = len(codes)
+        # The bounds of the range are found with Python integers, as
+        # (prefix + 1) << shift does not fit in 64 bits when k is 32 and
+        # the sequence is all T
+        shift = 2 * (k - length)
+        prefix = 0
+        for c in codes:
+            prefix = (prefix << 2) | int(c)
+        lo = np.searchsorted(self.kmers,np.uint64(prefix << shift),
+                             side='left')
+        hi = np.searchsorted(self.kmers,
+                             np.uint64((prefix << shift) | ((1 << shift) - 1)),
+                             side='right')
+        found = np.sort(self.positions[lo:hi]).astype(np.int64)
+        if length < k:
+            n = len(self.ref)
+            tailStart = max(n - k + 1,0)
+            tail = self.ref.codes(tailStart,n)
+            extra = []
+            for i in range(len(tail) - length + 1):
+                if np.array_equal(tail[i:i+length],codes):
+                    extra.append(tailStart + i)
+            if len(extra) > 0:
+                found = np.concatenate([found,np.array(extra,dtype=np.int64)])
+        return found
+
+    def align(self,read):
+        """
+        Finds the first two positions where the read appears in the reference.
+        """
+        return self.align_all([read])[0]
+
+    def align_short(self,read):
+        """
+        Aligns a read no longer than k, which is found directly with lookup.
+        """
+        if len(read) == 0:
+            return (0,1 if len(self.ref) > 0 else -1)
+        # A read with letters other than the four bases cannot appear in a
+        # packed reference
+        try:
+            codes = encode(read)
+        except RuntimeError:
+            return (-1,-1)
+        found = self.lookup(codes)
+        return (int(found[0]) if len(found) > 0 else -1,
+                int(found[1]) if len(found) > 1 else -1)
+
+    def verify(self,codes,candidates):
+        """
+        Checks candidate starting positions of a read against the reference
+        a few at a time, in increasing order, and returns a tuple with the
+        first two that match.
+        """
+        matches = []
+        step = 8
+        offsets = np.arange(len(codes),dtype=np.int64)
+        for i in range(0,len(candidates),step):
+            starts = candidates[i:i+step]
+            windows = gather(self.ref.packed,starts[:,None] + offsets)
+            ok = np.all(windows == codes,axis=1)
+            matches.extend(starts[ok].tolist())
+            if len(matches) >= 2:
+                break
+        while len(matches) < 2:
+            matches.append(-1)
+        return (matches[0],matches[1])
+
+    def align_all(self,reads):
+        """
+        Aligns a list of reads.
+
+        Reads longer than k are handled together in groups of the same
+        length: they are encoded as one 2D array, and every seed of every
+        read is looked up in the index with one binary search. The seed with
+        the fewest occurrences gives the candidate positions for each read.
+        A read whose rarest seed appears only once can match at most once,
+        so all such reads are checked together; the rest are checked one at
+        a time.
+        """
+        k = self.k
+        n = len(self.ref)
+        results = [None] * len(reads)
+        groups = dict()
+        for i, read in enumerate(reads):
+            if len(read) <= k:
+                results[i] = self.align_short(read)
+            elif len(read) in groups:
+                groups[len(read)].append(i)
+            else:
+                groups[len(read)] = [i]
+        for readLen, rows in groups.items():
+            if readLen > n:
+                for i in rows:
+                    results[i] = (-1,-1)
+                continue
+            text = "".join([reads[i] for i in rows]).encode()
+            codes = CODES[np.frombuffer(text,dtype=np.uint8)]
+            codes = codes.reshape(len(rows),readLen)
+            valid = np.all(codes != 255,axis=1)
+            offsets = list(range(0,readLen-k+1,k))
+            if offsets[-1] != readLen-k:
+                offsets.append(readLen-k)
+            # Look up every seed, and pick the rarest seed of each read
+            seeds = np.zeros((len(rows),len(offsets)),dtype=np.uint64)
+            for s, offset in enumerate(offsets):
+                for j in range(k):
+                    seeds[:,s] <<= np.uint64(2)
+                    seeds[:,s] |= (codes[:,offset+j] & 3).astype(np.uint64)
+            lo = np.searchsorted(self.kmers,seeds,side='left')
+            hi = np.searchsorted(self.kmers,seeds,side='right')
+            counts = np.where(valid[:,None],hi - lo,0)
+            best = np.argmin(counts,axis=1)
+            rowIndex = np.arange(len(rows))
+            bestCount = counts[rowIndex,best]
+            bestLo = lo[rowIndex,best]
+            bestOffset = np.array(offsets,dtype=np.int64)[best]
+            # Check the reads with one candidate together
+            single = np.nonzero(bestCount == 1)[0]
+            starts = self.positions[bestLo[single]].astype(np.int64)
+            starts -= bestOffset[single]
+            inRange = (starts >= 0) & (starts <= n - readLen)
+            starts = np.where(inRange,starts,0)
+            windows = gather(self.ref.packed,
+                             starts[:,None] + np.arange(readLen,dtype=np.int64))
+            ok = inRange & np.all(windows == codes[single],axis=1)
+            for r, start, match in zip(single.tolist(),starts.tolist(),
+                                       ok.tolist()):
+                results[rows[r]] = (start,-1) if match else (-1,-1)
+            # Check the rest one at a time
+            for r in range(len(rows)):
+                if bestCount[r] == 0:
+                    results[rows[r]] = (-1,-1)
+                elif bestCount[r] > 1:
+                    first = bestLo[r]
+                    candidates = self.positions[first:first+bestCount[r]]
+                    candidates = candidates.astype(np.int64) - bestOffset[r]
+                    candidates = candidates[(candidates >= 0)
+                                            & (candidates <= n - readLen)]
+                    results[rows[r]] = self.verify(codes[r],candidates)
+        return results
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3 or (sys.argv[1] == "--unpack" and len(sys.argv) < 4):
+        print("Usage:")
+        print("  $ python3 packedseq.py <text_file> <packed_file>")
+        print("  $ python3 packedseq.py --unpack <packed_file> <text_file>")
+        sys.exit(0)
+    try:
+        if sys.argv[1] == "--unpack":
+            seqs = PackedSequence.from_file(sys.argv[2])
+            with open(sys.argv[3],'w') as f:
+                if seqs.count == 1:
+                    f.write(seqs.sequence(0))
+                else:
+                    for i in range(seqs.count):
+                        f.write(seqs.sequence(i) + "\n")
+        else:
+            # A file with one line is a reference; otherwise each line is a
+            # read
+            with open(sys.argv[1],'r') as f:
+                lines = [line.strip() for line in f]
+            lines = [line for line in lines if len(line) > 0]
+            write_packed(sys.argv[2],encode("".join(lines)),len(lines))
+    except RuntimeError as e:
+        # Letters other than A, C, G, T, reads of different lengths, or a
+        # file that is not packed
+        print("ERROR: {}".format(e))
+        sys.exit(2)
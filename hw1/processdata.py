@@ -1,47 +1,285 @@
+import collections
+import itertools
+import multiprocessing
 import sys
 import time
+
+import aligners
+import packedseq
+
+# Function to align a list of reads against the reference, returning a list
+# with the first and second alignment positions of each read.
+# The aligner is a global variable so that worker processes created by fork
+# share the parent's copy of the reference and index rather than receiving
+# their own copy with each batch.
+def align_reads(reads):
+    return aligner.align_all(reads)
+
+# Function to look up a batch of reads in the cache of previous alignments.
+# Returns the stripped reads, a dictionary of the alignment of each distinct
+# read (None if it is not known yet), a list of the distinct reads that need
+# to be aligned, and a list of reads that an earlier batch that is still being
+# aligned will provide, with that batch's dictionary. Reads that repeat within
+# the batch, are found in the cache, or are provided by an earlier batch are
+# counted as cache hits.
+def lookup_batch(batch):
+    global cacheHits
+    reads = []
+    resolved = dict()
+    misses = []
+    borrowed = []
+    for read_ in batch:
+        read = read_.strip()
+        reads.append(read)
+        if read in resolved:
+            cacheHits = cacheHits + 1
+            continue
+        result = cache.get(read)
+        if result is not None:
+            cacheHits = cacheHits + 1
+        elif read in waiting:
+            cacheHits = cacheHits + 1
+            borrowed.append((read,waiting[read]))
+        else:
+            misses.append(read)
+            waiting[read] = resolved
+        resolved[read] = result
+    return (reads,resolved,misses,borrowed)
+
+# Function to record the alignments of the reads that were missing from the
+# cache, then write the lines of the alignment file for a batch.
+# Each line has the read, then its first and second positions as before. When
+# mismatches are allowed, the number of mismatches at each position is added
+# after the positions.
+# Batches are finished in the order they were read, so any earlier batch that
+# a read was borrowed from has already been finished.
+# Returns the lines as one string, along with the number of reads that align
+# zero, one, and two times.
+def finish_batch(reads,resolved,misses,borrowed,results):
+    for read, result in zip(misses,results):
+        resolved[read] = result
+        cache.put(read,result)
+        if waiting.get(read) is resolved:
+            del waiting[read]
+    for read, owner in borrowed:
+        resolved[read] = owner[read]
+    lines = []
+    align0 = 0
+    align1 = 0
+    align2 = 0
+    for read in reads:
+        result = resolved[read]
+        (firstAlign,secondAlign) = result[:2]
+        line = read + " " + str(firstAlign)
+        if firstAlign >= 0:
+            if secondAlign >= 0:
+                line += " " + str(secondAlign)
+                align2 = align2 + 1
+            else:
+                align1 = align1 + 1
+        else:
+            align0 = align0 + 1
+        # When mismatches are allowed, the number of mismatches at each
+        # alignment follows the positions
+        if len(result) > 2 and firstAlign >= 0:
+            line += " " + str(result[2])
+            if secondAlign >= 0:
+                line += " " + str(result[3])
+        lines.append(line + "\n")
+    return ("".join(lines),align0,align1,align2)
+
+# Function to align batches of reads, yielding the results in the same order
+# as the batches so that the alignment file keeps the order of the reads file.
+# Only the distinct reads in each batch that are not in the cache or already
+# being aligned for an earlier batch are aligned.
+# With more than one worker, batches are aligned in a pool of processes.
+# Only a few batches per worker are sent to the pool at a time, so the memory
+# used does not grow with the number of reads.
+def align_batches(batches,nWorkers):
+    if nWorkers == 1:
+        for batch in batches:
+            (reads,resolved,misses,borrowed) = lookup_batch(batch)
+            results = align_reads(misses)
+            yield finish_batch(reads,resolved,misses,borrowed,results)
+        return
+    pool = multiprocessing.get_context('fork').Pool(nWorkers)
+    pending = collections.deque()
+    for batch in batches:
+        lookup = lookup_batch(batch)
+        task = pool.apply_async(align_reads,(lookup[2],))
+        pending.append((lookup,task))
+        if len(pending) >= 2 * nWorkers:
+            (lookup,task) = pending.popleft()
+            yield finish_batch(*lookup,task.get())
+    while len(pending) > 0:
+        (lookup,task) = pending.popleft()
+        yield finish_batch(*lookup,task.get())
+    pool.close()
+    pool.join()
+
 if len(sys.argv) <= 3:
     # Not enough arguments, print usage message
     print("Usage:")
-    print("  $ python3 processdata.py <ref_file> <reads_file> <align_file>")
+    print("  $ python3 processdata.py <ref_file> <reads_file> <align_file> [options]")
+    print("The reference and reads files may be text or packed (see packedseq.py).")
+    print("Options:")
+    print("  --engine <find|kmer|sa|ac|packed>")
+    print("                              alignment method (default = find)")
+    print("  --k <length>                seed length for the kmer and packed engines")
+    print("                              (default = 12)")
+    print("  --index <index_file>        file to load the kmer index or suffix array")
+    print("                              from or save it to (sa default = <ref_file>.sa)")
+    print("  --mismatches <n>            number of mismatches allowed (kmer engine only,")
+    print("                              default = 0); the number of mismatches at each")
+    print("                              position is written after the positions")
+    print("  --workers <n>               number of processes to align with (default = 1)")
+    print("  --batch-size <n>            number of reads aligned at a time (default = 10000,")
+    print("                              or 50000 for the ac engine); the ac engine builds")
+    print("                              an automaton and scans the whole reference once per")
+    print("                              batch, so larger batches take fewer passes but more")
+    print("                              memory (about 10 KB per distinct 50-base read)")
+    print("  --cache-size <n>            number of distinct reads whose alignments are")
+    print("                              kept for repeated reads (default = 100000)")
     sys.exit(0)
 # Assign inputs to variables
 refFile = sys.argv[1]
 readsFile = sys.argv[2]
 alignFile = sys.argv[3]
-# Read reference (removing line break at end)
-with open(refFile,'r') as f1:
-    reference = (f1.read()).strip()
-# Read reads file and create a list, with each read as a separate element
-with open(readsFile,'r') as f2:
-    reads = f2.readlines()
+# Options are given as pairs of a name and a value after the required inputs
+options = {'engine': 'find', 'k': '12', 'index': None, 'workers': '1',
+           'batch-size': None, 'cache-size': '100000', 'mismatches': '0'}
+optionArgs = sys.argv[4:]
+if len(optionArgs) % 2 != 0:
+    print("ERROR: option {} has no value".format(optionArgs[-1]))
+    sys.exit(2)
+for i in range(0,len(optionArgs),2):
+    name = optionArgs[i][2:]
+    if not optionArgs[i].startswith("--") or name not in options:
+        print("ERROR: unknown option {}".format(optionArgs[i]))
+        sys.exit(2)
+    options[name] = optionArgs[i+1]
+# The ac engine builds an automaton from each batch and scans the whole
+# reference for it, so its time grows with the reference length times the
+# number of batches. Its batches are larger by default to cut down the
+# number of passes; they are not unlimited because the automaton takes about
+# 10 KB per distinct 50-base read.
+if options['batch-size'] is None:
+    if options['engine'] == 'ac':
+        options['batch-size'] = '50000'
+    else:
+        options['batch-size'] = '10000'
+for name in ('k','workers','batch-size','cache-size','mismatches'):
+    try:
+        options[name] = int(options[name])
+    except ValueError:
+        print("ERROR: option --{} must be an integer".format(name))
+        sys.exit(2)
+k = options['k']
+if options['engine'] == 'packed' and not 1 <= k <= 32:
+    print("ERROR: k-mer length must be from 1 to 32 for the packed engine")
+    sys.exit(2)
+if options['engine'] == 'kmer' and k < 1:
+    print("ERROR: k-mer length must be positive")
+    sys.exit(2)
+nWorkers = options['workers']
+if nWorkers < 1:
+    print("ERROR: number of workers must be positive")
+    sys.exit(2)
+mismatches = options['mismatches']
+if mismatches < 0:
+    print("ERROR: number of mismatches must not be negative")
+    sys.exit(2)
+if mismatches > 0 and options['engine'] != 'kmer':
+    print("ERROR: mismatches are only supported by the kmer engine")
+    sys.exit(2)
+batchSize = options['batch-size']
+if batchSize < 1:
+    print("ERROR: batch size must be positive")
+    sys.exit(2)
+if options['cache-size'] < 0:
+    print("ERROR: cache size must not be negative")
+    sys.exit(2)
+# Set up the alignment engine. Building an index is done here so that it is
+# not included in the elapsed time. The suffix array engine maps the reference
+# file into memory itself, and the packed engine keeps the reference 2 bits
+# per base; the others read the reference (removing the line break at the
+# end) into a string. A reference in the packed format is memory-mapped.
+refPacked = packedseq.is_packed(refFile)
+if options['engine'] == 'sa':
+    if refPacked:
+        print("ERROR: the sa engine needs a text reference file")
+        sys.exit(2)
+    import suffixarray
+    aligner = suffixarray.SuffixArrayAligner(refFile,options['index'])
+elif options['engine'] == 'packed':
+    if refPacked:
+        packedRef = packedseq.PackedSequence.from_file(refFile)
+    else:
+        with open(refFile,'r') as f1:
+            try:
+                packedRef = packedseq.PackedSequence.from_text(f1.read().strip())
+            except RuntimeError as e:
+                print("ERROR: {}".format(e))
+                sys.exit(2)
+    aligner = packedseq.PackedAligner(packedRef,k)
+elif options['engine'] in ('find','kmer','ac'):
+    if refPacked:
+        reference = packedseq.PackedSequence.from_file(refFile).sequence(0)
+    else:
+        with open(refFile,'r') as f1:
+            reference = (f1.read()).strip()
+    if options['engine'] == 'find':
+        aligner = aligners.FindAligner(reference)
+    elif options['engine'] == 'ac':
+        aligner = aligners.AhoCorasickAligner(reference)
+    elif mismatches > 0:
+        aligner = aligners.SeedExtendAligner(reference,mismatches,k,
+                                             options['index'])
+    else:
+        aligner = aligners.KmerAligner(reference,k,options['index'])
+else:
+    print("ERROR: unknown engine {}".format(options['engine']))
+    sys.exit(2)
+# Set up the cache of alignments of recent distinct reads
+cache = aligners.AlignmentCache(options['cache-size'])
+cacheHits = 0
+# Reads that are being aligned for a batch that has not been finished yet,
+# with that batch's dictionary of alignments
+waiting = dict()
 # Intialize variables to record reads of each type
+nReads = 0
 align0 = 0.0
 align1 = 0.0
 align2 = 0.0
+# Size of the buffer used when writing the alignment file, so that each batch
+# of output is written in a few large pieces.
+bufferSize = 4 * 1024 * 1024
 # Record start time
 timeStart = time.time()
-with open(alignFile,'w') as f3:
-    for read_ in reads:
-        read = read_.strip()
-        firstAlign = reference.find(read)
-        f3.write(read + " " + str(firstAlign))
-        if firstAlign >= 0:
-            secondAlign = reference.find(read,firstAlign+1)
-            if secondAlign >=0:
-                f3.write(" " + str(secondAlign))
-                align2 = align2 + 1
-            else:
-                align1 = align1 + 1
-        else:
-            align0 = align0 + 1
-        f3.write("\n")
+# The reads file is read in batches, rather than all at once, so that the
+# memory used does not depend on the number of reads. Each batch is aligned,
+# and its lines are written to the alignment file together.
+# A reads file in the packed format is memory-mapped, and each batch of reads
+# is unpacked when it is needed.
+with open(readsFile,'r') as f2, open(alignFile,'w',buffering=bufferSize) as f3:
+    if packedseq.is_packed(readsFile):
+        packedReads = packedseq.PackedSequence.from_file(readsFile)
+        batches = (packedReads.sequences(i,min(i+batchSize,packedReads.count))
+                   for i in range(0,packedReads.count,batchSize))
+    else:
+        batches = iter(lambda: list(itertools.islice(f2,batchSize)),[])
+    for (lines,n0,n1,n2) in align_batches(batches,nWorkers):
+        f3.write(lines)
+        nReads = nReads + n0 + n1 + n2
+        align0 = align0 + n0
+        align1 = align1 + n1
+        align2 = align2 + n2
 timeStop = time.time()
 timeElapsed = timeStop - timeStart
-nReads = len(reads)
-print("reference length: {}".format(len(reference)))
+print("reference length: {}".format(len(aligner)))
 print("number reads: {}".format(nReads))
 print("aligns 0: {}".format(align0/nReads))
 print("aligns 1: {}".format(align1/nReads))
 print("aligns 2: {}".format(align2/nReads))
+print("cache hit rate: {}".format(cacheHits/nReads))
 print("elapsed time: {}".format(timeElapsed))
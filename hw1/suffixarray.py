@@ -0,0 +1,287 @@
+"""
+This module contains a disk-resident suffix array used to align reads
+against very large reference sequences.
+"""
+
+# Import useful modules
+import heapq
+import mmap
+import os
+import struct
+
+import numpy as np
+
+# Layout of the header at the start of a suffix array file: a magic string,
+# followed by the size of each stored position in bytes, the first and last
+# (exclusive) bytes of the sequence in the reference file, and the size and
+# modification time of the reference file when the array was built.
+MAGIC = b"HW1SA\x00\x00\x01"
+HEADER = struct.Struct("<8s5Q")
+
+def sequence_bounds(data):
+    """
+    Finds the first and last (exclusive) bytes of the sequence in a
+    reference file, skipping whitespace at either end in the same way as
+    the strip function.
+    """
+    start = 0
+    end = len(data)
+    while start < end and data[start:start+1].isspace():
+        start += 1
+    while end > start and data[end-1:end].isspace():
+        end -= 1
+    return (start,end)
+
+def build_suffix_array(text):
+    """
+    Builds the suffix array of a sequence given as a numpy uint8 array.
+
+    This uses prefix doubling: after each pass, suffixes are sorted by their
+    first h characters, and the ranks from that pass are combined in pairs
+    to sort by the first 2h characters. It stops once every rank is unique.
+
+    Positions and ranks are stored as 4-byte integers unless the sequence is
+    too long for them, and the same few arrays are reused by every pass, so
+    the memory needed is a small multiple of the length of the sequence.
+    """
+    n = len(text)
+    if n == 0:
+        return np.zeros(0,dtype=np.int64)
+    dtype = np.int32 if n < 2**31 else np.int64
+    # Number the characters 0 to (number of distinct characters - 1), so
+    # that every rank is less than n from the start
+    present = np.zeros(256,dtype=bool)
+    present[text] = True
+    rank = (np.cumsum(present) - 1).astype(dtype)[text]
+    sa = np.argsort(rank,kind='stable').astype(dtype)
+    order = np.empty(n,dtype=dtype)
+    first = np.empty(n,dtype=dtype)
+    second = np.empty(n,dtype=dtype)
+    h = 1
+    while rank[sa[-1]] != n - 1 and h < n:
+        # Order the suffixes by the rank of suffix i+h: the suffixes that run
+        # off the end come first, and the others follow the current order
+        # of the suffixes h places after them
+        order[:h] = np.arange(n - h,n,dtype=dtype)
+        np.compress(sa >= h,sa,out=order[h:])
+        order[h:] -= h
+        # A stable sort on the rank of suffix i then orders the suffixes by
+        # (rank of suffix i, rank of suffix i+h)
+        np.take(rank,order,out=first)
+        np.take(order,np.argsort(first,kind='stable'),out=sa)
+        # Find the pairs of both ranks in the new order, with 0 as the
+        # second rank of the suffixes that run off the end and the others
+        # shifted up by one, and number the distinct pairs. The suffixes
+        # that run off the end keep an old position in order, which is a
+        # valid index whose rank is then replaced by 0.
+        np.take(rank,sa,out=first)
+        inside = sa < n - h
+        np.add(sa,h,out=order,where=inside)
+        np.take(rank,order,out=second)
+        second += 1
+        second[~inside] = 0
+        newGroup = first[1:] != first[:-1]
+        newGroup |= second[1:] != second[:-1]
+        order[0] = 0
+        np.cumsum(newGroup,out=order[1:])
+        rank[sa] = order
+        h *= 2
+    return sa
+
+class SuffixArrayAligner:
+    """
+    SuffixArrayAligner: aligns reads using a memory-mapped suffix array.
+
+    The suffix array lists the starting position of every suffix of the
+    reference in sorted order, so all occurrences of a read are next to
+    each other in it and can be found with two binary searches. Both the
+    reference file and the suffix array file are opened with mmap, so the
+    reference is never read into a string and several processes aligning
+    against the same reference share the same pages.
+
+    Attributes:
+    -----------
+    refFile : str
+        the path name of the reference file
+    saFile : str
+        the path name of the suffix array file
+    start : int
+        the position of the first base in the reference file
+    end : int
+        the position after the last base in the reference file
+    ref : mmap
+        the contents of the reference file
+    sa : memoryview
+        the suffix array, as positions relative to start
+
+    Methods:
+    --------
+    build(saFile)
+        builds the suffix array and writes it to a file
+    load(saFile)
+        opens a suffix array file, or returns False if it is out of date
+    search(read)
+        returns the range of the suffix array matching the read
+    count(read)
+        returns the number of times a read appears in the reference
+    align(read)
+        returns a tuple with the first and second alignment positions
+    align_all(reads)
+        returns a list with the alignment positions of each read
+    """
+
+    def __init__(self,refFile,saFile=None):
+        """
+        Constructs an aligner for the given reference file.
+
+        The suffix array is loaded from saFile (by default, the reference
+        file name with '.sa' added), and is built first if the file is
+        missing or was built from an older version of the reference.
+        """
+        if not os.path.exists(refFile):
+            raise RuntimeError("Reference file does not exist")
+        self.refFile = refFile
+        if saFile is None:
+            saFile = refFile + ".sa"
+        self.saFile = saFile
+        with open(refFile,'rb') as f:
+            if os.path.getsize(refFile) > 0:
+                self.ref = mmap.mmap(f.fileno(),0,access=mmap.ACCESS_READ)
+            else:
+                self.ref = b""
+        (self.start,self.end) = sequence_bounds(self.ref)
+        if not (os.path.exists(saFile) and self.load(saFile)):
+            self.build(saFile)
+            self.load(saFile)
+
+    def __len__(self):
+        """
+        Returns the length of the reference sequence.
+        """
+        return self.end - self.start
+
+    def file_stamp(self):
+        """
+        Returns the size and modification time of the reference file, which
+        are stored with the suffix array to detect when it is out of date.
+        """
+        stat = os.stat(self.refFile)
+        return (stat.st_size,stat.st_mtime_ns)
+
+    def build(self,saFile):
+        """
+        Builds the suffix array and writes it to a file.
+
+        Positions are stored as 4-byte integers when the reference is short
+        enough, and 8-byte integers otherwise.
+        """
+        n = len(self)
+        if n > 0:
+            text = np.frombuffer(self.ref,dtype=np.uint8)[self.start:self.end]
+        else:
+            text = np.zeros(0,dtype=np.uint8)
+        sa = build_suffix_array(text)
+        if n < 2**32:
+            sa = sa.astype(np.uint32)
+        else:
+            sa = sa.astype(np.uint64)
+        (size,mtime) = self.file_stamp()
+        header = HEADER.pack(MAGIC,sa.itemsize,self.start,self.end,size,mtime)
+        with open(saFile,'wb') as f:
+            f.write(header)
+            f.write(sa.tobytes())
+
+    def load(self,saFile):
+        """
+        Opens a suffix array file.
+
+        Returns False if the file is not a suffix array, or if it was built
+        from a different version of the reference file.
+        """
+        with open(saFile,'rb') as f:
+            header = f.read(HEADER.size)
+            if len(header) < HEADER.size:
+                return False
+            (magic,itemsize,start,end,size,mtime) = HEADER.unpack(header)
+            if magic != MAGIC or (size,mtime) != self.file_stamp():
+                return False
+            if (start,end) != (self.start,self.end):
+                return False
+            if os.path.getsize(saFile) > HEADER.size:
+                data = mmap.mmap(f.fileno(),0,access=mmap.ACCESS_READ)
+            else:
+                data = b""
+        typecode = 'I' if itemsize == 4 else 'Q'
+        self.sa = memoryview(data)[HEADER.size:].cast(typecode)
+        return True
+
+    def search(self,read):
+        """
+        Finds the range of the suffix array whose suffixes begin with the
+        read, using two binary searches.
+
+        Each comparison looks at no more than len(read) bytes, so the search
+        takes O(len(read) * log(n)) time. Returns the first and last
+        (exclusive) indices of the range.
+        """
+        key = read.encode()
+        readLen = len(key)
+        ref = self.ref
+        sa = self.sa
+        start = self.start
+        end = self.end
+        # Find the first suffix that is not less than the read
+        lo = 0
+        hi = len(sa)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            pos = start + sa[mid]
+            if ref[pos:min(pos+readLen,end)] < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        first = lo
+        # Find the first suffix whose first len(read) bytes are greater than
+        # the read
+        hi = len(sa)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            pos = start + sa[mid]
+            if ref[pos:min(pos+readLen,end)] <= key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return (first,lo)
+
+    def count(self,read):
+        """
+        Returns the number of times a read appears in the reference.
+        """
+        (first,last) = self.search(read)
+        return last - first
+
+    def align(self,read):
+        """
+        Finds the first two positions where the read appears in the reference.
+
+        The positions in the matching range of the suffix array are in the
+        order of the suffixes rather than the order of the reference, so the
+        two smallest are taken.
+        """
+        (first,last) = self.search(read)
+        if last - first == 1:
+            return (self.sa[first],-1)
+        found = heapq.nsmallest(2,self.sa[first:last])
+        while len(found) < 2:
+            found.append(-1)
+        return (found[0],found[1])
+
+    def align_all(self,reads):
+        """
+        Aligns a list of reads, returning a list with the first and second
+        alignment positions of each read.
+        """
+        results = []
+        for read in reads:
+            results.append(self.align(read))
+        return results
@@ -0,0 +1,84 @@
+"""
+Checks the suffix array engine against the find engine.
+"""
+
+# Import useful modules
+import os
+import random
+import tempfile
+import unittest
+
+import numpy as np
+
+import aligners
+import suffixarray
+
+class SuffixArrayTest(unittest.TestCase):
+    """
+    SuffixArrayTest: compares suffix arrays with sorted suffixes, and the
+    alignments of the suffix array engine with those of the find engine,
+    on short and random references.
+    """
+
+    def check_reference(self,reference,reads):
+        """
+        Checks that the suffix array engine aligns every read in the same
+        place as the find engine.
+        """
+        with tempfile.TemporaryDirectory() as tmpdir:
+            refFile = os.path.join(tmpdir,"ref.txt")
+            with open(refFile,'w') as f:
+                f.write(reference + "\n")
+            aligner = suffixarray.SuffixArrayAligner(refFile)
+            expected = aligners.FindAligner(reference).align_all(reads)
+            found = [(int(first),int(second))
+                     for (first,second) in aligner.align_all(reads)]
+            aligner.ref.close()
+            self.assertEqual(found,expected,reference)
+
+    def test_sorted_suffixes(self):
+        """
+        Checks build_suffix_array against sorting the suffixes directly.
+        """
+        rng = random.Random(0)
+        references = ["A","AC","AAC","AAAC","GCG","AAAA"]
+        for i in range(500):
+            length = rng.randint(1,120)
+            references.append("".join(rng.choice("ACGT")
+                                      for j in range(length)))
+        for reference in references:
+            text = np.frombuffer(reference.encode(),dtype=np.uint8)
+            sa = suffixarray.build_suffix_array(text)
+            expected = sorted(range(len(reference)),
+                              key=lambda i: reference[i:])
+            self.assertEqual(sa.tolist(),expected,reference)
+
+    def test_short_references(self):
+        """
+        Checks the alignments on short references, where the character
+        codes are larger than the length of the reference.
+        """
+        self.check_reference("GCG",["CG","G","GC","C","A"])
+        self.check_reference("AC",["A","C","AC","CA"])
+        self.check_reference("AAAC",["A","AA","AAC","C"])
+
+    def test_random_references(self):
+        """
+        Checks the alignments on random references, with reads taken from
+        the reference and random reads.
+        """
+        rng = random.Random(1)
+        for i in range(200):
+            length = rng.randint(1,200)
+            reference = "".join(rng.choice("ACGT") for j in range(length))
+            reads = []
+            for j in range(20):
+                readLen = rng.randint(1,min(length,10))
+                start = rng.randint(0,length - readLen)
+                reads.append(reference[start:start+readLen])
+                reads.append("".join(rng.choice("ACGT")
+                                     for k in range(readLen)))
+            self.check_reference(reference,reads)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,271 @@
+# This module keeps the state needed to update the similarity coefficients of
+# similarity.py when new ratings arrive, without comparing every pair of
+# movies again.
+#
+# The state holds the raw ratings (see ratings.RatingsStore), the sum, sum of
+# squares, and number of the ratings of each movie, and for each pair of
+# movies with enough shared users the sums over those users:
+#   n        number of shared users
+#   sum1     sum of the first movie's ratings
+#   sum2     sum of the second movie's ratings
+#   sumsq1   sum of the squares of the first movie's ratings
+#   sumsq2   sum of the squares of the second movie's ratings
+#   sumprod  sum of the products of the two movies' ratings
+# These are sums of raw ratings rather than deviations from the average, so
+# they stay correct when the average of a movie changes. With mu1 the
+# average of all of the first movie's ratings and m1 = sum1/n the average
+# over the shared users (and likewise for the second movie):
+#   sum over shared users of (r1-mu1)^2        = (sumsq1 - sum1*m1) + n*(m1-mu1)^2
+#   sum over shared users of (r1-mu1)*(r2-mu2) = (sumprod - sum1*m2)
+#                                                + n*(m1-mu1)*(m2-mu2)
+# which give the similarity coefficient of the pair. Written this way, the
+# sums are exactly zero when all of a movie's shared ratings equal its
+# average, as they are in similarity.py.
+#
+# When new ratings are added, only the movies they rate are touched. The
+# pair sums of the touched movies are found again from the raw ratings, and
+# the best matches are found again for the touched movies and the movies
+# paired with them.
+
+# Import modules
+import json
+import os
+
+import numpy as np
+
+import ratings
+import sparsesim
+
+# Version of the state format, stored in the state so that states written in
+# an older format are not used
+STATE_VERSION = 1
+# Names of the arrays of pair sums
+PAIR_FIELDS = ['first','second','n','sum1','sum2','sumsq1','sumsq2','sumprod']
+# Names of the arrays of the ratings store
+STORE_FIELDS = ['movieIds','offsets','users','values']
+# Names of the arrays of movie sums
+MOVIE_FIELDS = ['sums','sumsq','counts']
+
+# Function to find the pair sums of a set of movies with every other movie,
+# from the raw ratings in the store and its user index.
+# inSet is a boolean array marking the movies whose sums are wanted. A pair
+# of two movies in the set is only found once, from the movie that comes
+# first. Only pairs with at least userThresh shared users are kept.
+# Returns a dictionary of the arrays named in PAIR_FIELDS, with the first
+# movie of each pair before the second.
+def pair_sums(store,userIdx,inSet,userThresh):
+    found = dict((name,[]) for name in PAIR_FIELDS)
+    for movie1 in np.nonzero(inSet)[0]:
+        (others,pos1,pos2) = store.co_ratings(userIdx,movie1)
+        keep = ~inSet[others] | (others > movie1)
+        (others,pos1,pos2) = (others[keep],pos1[keep],pos2[keep])
+        (movies2,groups,nShared) = np.unique(others,return_inverse=True,
+                                             return_counts=True)
+        enough = nShared >= userThresh
+        keep = enough[groups]
+        groups = (np.cumsum(enough) - 1)[groups[keep]]
+        movies2 = movies2[enough]
+        nGroups = len(movies2)
+        r1 = store.values[pos1[keep]]
+        r2 = store.values[pos2[keep]]
+        sum1 = np.bincount(groups,weights=r1,minlength=nGroups)
+        sum2 = np.bincount(groups,weights=r2,minlength=nGroups)
+        sumsq1 = np.bincount(groups,weights=r1 * r1,minlength=nGroups)
+        sumsq2 = np.bincount(groups,weights=r2 * r2,minlength=nGroups)
+        sumprod = np.bincount(groups,weights=r1 * r2,minlength=nGroups)
+        # Put the movie that comes first in each pair first
+        swap = movies2 < movie1
+        found['first'].append(np.where(swap,movies2,movie1))
+        found['second'].append(np.where(swap,movie1,movies2))
+        found['n'].append(nShared[enough])
+        found['sum1'].append(np.where(swap,sum2,sum1))
+        found['sum2'].append(np.where(swap,sum1,sum2))
+        found['sumsq1'].append(np.where(swap,sumsq2,sumsq1))
+        found['sumsq2'].append(np.where(swap,sumsq1,sumsq2))
+        found['sumprod'].append(sumprod)
+    pairs = dict()
+    for name in PAIR_FIELDS:
+        dtype = np.int64 if name in ('first','second','n') else np.float64
+        pairs[name] = np.concatenate([np.zeros(0,dtype=dtype)] + found[name])
+        pairs[name] = pairs[name].astype(dtype)
+    return pairs
+
+# Function to find the sum, sum of squares, and number of the ratings of the
+# movies at the given positions
+def movie_sums(store,movies):
+    sums = np.zeros(len(movies))
+    sumsq = np.zeros(len(movies))
+    for (i,movie) in enumerate(movies):
+        values = store.values[store.offsets[movie]:store.offsets[movie+1]]
+        sums[i] = values.sum()
+        sumsq[i] = (values * values).sum()
+    return (sums,sumsq,store.counts()[movies])
+
+# Function to find the similarity coefficient of each pair from the pair
+# sums (see pair_sums) and the average rating of each movie.
+# Returns the coefficients and a boolean array marking the pairs with a
+# valid coefficient (a nonzero denominator).
+def pair_similarities(pairs,averages):
+    n = pairs['n'].astype(np.float64)
+    m1 = pairs['sum1'] / n
+    m2 = pairs['sum2'] / n
+    d1 = m1 - averages[pairs['first']]
+    d2 = m2 - averages[pairs['second']]
+    # Rounding can leave a tiny negative sum of squares where the exact value
+    # is zero
+    s1 = np.maximum((pairs['sumsq1'] - pairs['sum1'] * m1) + n * d1 * d1,0.0)
+    s2 = np.maximum((pairs['sumsq2'] - pairs['sum2'] * m2) + n * d2 * d2,0.0)
+    s12 = (pairs['sumprod'] - pairs['sum1'] * m2) + n * d1 * d2
+    denominator = s1 * s2
+    valid = denominator != 0
+    sim = np.zeros(len(n))
+    sim[valid] = s12[valid] / np.sqrt(denominator[valid])
+    return (sim,valid)
+
+# Function to find the topK most similar movies to each of the movies at the
+# given positions (or to every movie if movies is None), from the pair sums
+# and the similarity coefficient of each pair (see pair_similarities).
+# Returns a dictionary in the form returned by sparsesim.top_matches.
+def pair_top_matches(pairs,sim,valid,movieIds,topK,movies=None):
+    # Each pair is a candidate for both of its movies
+    rows = np.concatenate([pairs['first'][valid],pairs['second'][valid]])
+    cols = np.concatenate([pairs['second'][valid],pairs['first'][valid]])
+    sims = np.concatenate([sim[valid],sim[valid]])
+    nShared = np.concatenate([pairs['n'][valid],pairs['n'][valid]])
+    if movies is not None:
+        wanted = np.zeros(len(movieIds),dtype=bool)
+        wanted[movies] = True
+        keep = wanted[rows]
+        (rows,cols,sims,nShared) = (rows[keep],cols[keep],sims[keep],
+                                    nShared[keep])
+    return sparsesim.merge_candidates(movieIds,[(rows,cols,sims,nShared)],
+                                      topK)
+
+# Class holding the state used to update the similarity coefficients.
+#
+# Attributes:
+#   store: the raw ratings, as a ratings.RatingsStore
+#   sums, sumsq, counts: arrays of the sum, sum of squares, and number of the
+#                        ratings of each movie, by position in the store
+#   pairs: dictionary of the arrays of pair sums named in PAIR_FIELDS, for
+#          the pairs with at least userThresh shared users
+#   userThresh: minimum number of shared users
+#   topK: number of most similar movies kept for each movie
+class SimilarityState:
+    def __init__(self,store,sums,sumsq,counts,pairs,userThresh,topK):
+        self.store = store
+        self.sums = sums
+        self.sumsq = sumsq
+        self.counts = counts
+        self.pairs = pairs
+        self.userThresh = userThresh
+        self.topK = topK
+
+    # Function to build the state from a store of raw ratings
+    @classmethod
+    def build(cls,store,userThresh,topK):
+        movies = np.arange(len(store))
+        (sums,sumsq,counts) = movie_sums(store,movies)
+        inSet = np.ones(len(store),dtype=bool)
+        pairs = pair_sums(store,store.user_index(),inSet,userThresh)
+        return cls(store,sums,sumsq,counts,pairs,userThresh,topK)
+
+    # Function to read a state saved by save
+    @classmethod
+    def load(cls,stateDir):
+        try:
+            with open(os.path.join(stateDir,"meta.json"),'r') as f:
+                meta = json.load(f)
+        except (OSError,ValueError):
+            raise RuntimeError("No similarity state in " + stateDir)
+        if meta.get('version') != STATE_VERSION:
+            raise RuntimeError("Similarity state in {} has an unknown version"
+                               .format(stateDir))
+        arrays = dict()
+        for name in STORE_FIELDS + MOVIE_FIELDS + PAIR_FIELDS:
+            arrays[name] = np.load(os.path.join(stateDir,name + ".npy"))
+        store = ratings.RatingsStore(*[arrays[name] for name in STORE_FIELDS])
+        pairs = dict((name,arrays[name]) for name in PAIR_FIELDS)
+        return cls(store,arrays['sums'],arrays['sumsq'],arrays['counts'],
+                   pairs,meta['userThresh'],meta['topK'])
+
+    # Function to save the state in a directory.
+    # The metadata is written last, and removed first, so a state that was
+    # only partly written is never used.
+    def save(self,stateDir):
+        os.makedirs(stateDir,exist_ok=True)
+        metaFile = os.path.join(stateDir,"meta.json")
+        if os.path.exists(metaFile):
+            os.remove(metaFile)
+        arrays = {'sums': self.sums, 'sumsq': self.sumsq,
+                  'counts': self.counts}
+        for name in STORE_FIELDS:
+            arrays[name] = getattr(self.store,name)
+        arrays.update(self.pairs)
+        for (name,values) in arrays.items():
+            np.save(os.path.join(stateDir,name + ".npy"),values)
+        meta = {'version': STATE_VERSION, 'userThresh': self.userThresh,
+                'topK': self.topK}
+        with open(metaFile + ".tmp",'w') as f:
+            json.dump(meta,f)
+        os.replace(metaFile + ".tmp",metaFile)
+
+    # Function to add new ratings, given as arrays of the user id, movie id,
+    # and rating of each (as returned by ratings.load_ratings). A new rating
+    # of a movie by a user replaces any earlier one.
+    # Returns an array of the positions of the movies whose best matches may
+    # have changed: the movies rated by the new ratings, and the movies
+    # paired with them before or after the update.
+    def update(self,users,movies,values):
+        (oldUsers,oldMovies,oldValues) = self.store.columns()
+        store = ratings.RatingsStore.from_columns(
+            np.concatenate([oldUsers,users]),
+            np.concatenate([oldMovies,movies]),
+            np.concatenate([oldValues,values]))
+        # The movies keep their positions, and new movies are added at the
+        # end, since the old ratings come first in order of position
+        nMovies = len(store)
+        order = np.argsort(store.movieIds)
+        touched = order[np.searchsorted(store.movieIds[order],
+                                        np.unique(movies))]
+        inSet = np.zeros(nMovies,dtype=bool)
+        inSet[touched] = True
+        # Find the sums of the touched movies again
+        for (name,old) in [('sums',self.sums),('sumsq',self.sumsq),
+                           ('counts',self.counts)]:
+            grown = np.zeros(nMovies,dtype=old.dtype)
+            grown[:len(old)] = old
+            setattr(self,name,grown)
+        (self.sums[touched],self.sumsq[touched],self.counts[touched]) = \
+            movie_sums(store,touched)
+        # Replace the pairs of the touched movies
+        first = self.pairs['first']
+        second = self.pairs['second']
+        stale = inSet[first] | inSet[second]
+        partners = [first[stale],second[stale]]
+        newPairs = pair_sums(store,store.user_index(),inSet,self.userThresh)
+        partners += [newPairs['first'],newPairs['second']]
+        merged = dict()
+        for name in PAIR_FIELDS:
+            merged[name] = np.concatenate([self.pairs[name][~stale],
+                                           newPairs[name]])
+        order = np.lexsort((merged['second'],merged['first']))
+        self.pairs = dict((name,merged[name][order]) for name in PAIR_FIELDS)
+        self.store = store
+        return np.unique(np.concatenate([touched] + partners))
+
+    # Function to find the similarity coefficient of each pair from the pair
+    # sums and the current averages (see pair_similarities)
+    def similarities(self):
+        return pair_similarities(self.pairs,self.sums / self.counts)
+
+    # Function to find the topK most similar movies to each of the movies at
+    # the given positions (or to every movie if movies is None). A different
+    # number of movies than the state's topK can be asked for.
+    # Returns a dictionary in the form returned by sparsesim.top_matches.
+    def top_matches(self,movies=None,topK=None):
+        if topK is None:
+            topK = self.topK
+        (sim,valid) = self.similarities()
+        return pair_top_matches(self.pairs,sim,valid,
+                                self.store.movieIds.tolist(),topK,movies)
@@ -0,0 +1,73 @@
+# This module holds the similarity measures that similarity.py can compute
+# for each pair of movies. Every measure is found from the same sums over the
+# shared users of each pair (see incremental.pair_sums):
+#   n, sum1, sum2, sumsq1, sumsq2, sumprod
+# and from the sum and number of the ratings of each movie, so the pairs of
+# movies only need to be gone through once however many measures are wanted.
+#
+# Each measure is a function taking the pair sums and the arrays of the sum
+# and number of the ratings of each movie, and returning the coefficient of
+# each pair and a boolean array marking the pairs with a valid coefficient.
+# New measures are added to the METRICS dictionary.
+
+# Import modules
+import numpy as np
+
+import incremental
+
+# Function to find the coefficient of the assignment: the cosine of the
+# ratings of the shared users after subtracting the average of all of each
+# movie's ratings
+def adjusted(pairs,sums,counts):
+    return incremental.pair_similarities(pairs,sums / counts)
+
+# Function to find the cosine of the raw ratings of the shared users
+def cosine(pairs,sums,counts):
+    denominator = pairs['sumsq1'] * pairs['sumsq2']
+    valid = denominator != 0
+    sim = np.zeros(len(denominator))
+    sim[valid] = pairs['sumprod'][valid] / np.sqrt(denominator[valid])
+    return (sim,valid)
+
+# Function to find the Pearson correlation of the ratings of the shared
+# users, which subtracts the average over the shared users rather than over
+# all of a movie's ratings
+def pearson(pairs,sums,counts):
+    n = pairs['n'].astype(np.float64)
+    m1 = pairs['sum1'] / n
+    m2 = pairs['sum2'] / n
+    # Rounding can leave a tiny negative sum of squares where the exact value
+    # is zero
+    s1 = np.maximum(pairs['sumsq1'] - pairs['sum1'] * m1,0.0)
+    s2 = np.maximum(pairs['sumsq2'] - pairs['sum2'] * m2,0.0)
+    s12 = pairs['sumprod'] - pairs['sum1'] * m2
+    denominator = s1 * s2
+    valid = denominator != 0
+    sim = np.zeros(len(n))
+    sim[valid] = s12[valid] / np.sqrt(denominator[valid])
+    return (sim,valid)
+
+# Function to find the Jaccard similarity of the sets of users who rated each
+# movie: the number of shared users divided by the number of users who rated
+# either movie
+def jaccard(pairs,sums,counts):
+    n = pairs['n'].astype(np.float64)
+    either = counts[pairs['first']] + counts[pairs['second']] - n
+    return (n / either,np.ones(len(n),dtype=bool))
+
+# Dictionary of the measures, by the names used on the command line
+METRICS = {'adjusted': adjusted, 'cosine': cosine, 'pearson': pearson,
+           'jaccard': jaccard}
+
+# Function to find the topK most similar movies to each movie by each of a
+# list of measures, from the pair sums and the sum and number of the ratings
+# of each movie.
+# Returns a dictionary whose keys are the names of the measures and whose
+# values are dictionaries in the form returned by sparsesim.top_matches.
+def top_matches(names,pairs,sums,counts,movieIds,topK):
+    results = dict()
+    for name in names:
+        (sim,valid) = METRICS[name](pairs,sums,counts)
+        results[name] = incremental.pair_top_matches(pairs,sim,valid,movieIds,
+                                                     topK)
+    return results
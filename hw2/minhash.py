@@ -0,0 +1,199 @@
+# This module finds approximate best matches for very large numbers of movies
+# by only computing the similarity coefficients of likely pairs.
+#
+# Each movie's set of users is summarized by a MinHash signature: for each of
+# bands x rows random hash functions, the smallest hash of any of the movie's
+# users. Two movies get the same value for a hash function with probability
+# equal to the Jaccard similarity of their user sets (shared users divided by
+# users of either movie). The signatures are cut into bands of rows values,
+# and two movies become a candidate pair if all the values of any band are
+# the same (locality-sensitive hashing). Pairs with many shared users
+# relative to their numbers of ratings are therefore likely to be candidates,
+# while most pairs with few shared users are never looked at. More bands, or
+# fewer rows per band, find more pairs at the cost of more candidates.
+#
+# The similarity coefficient of each candidate pair is then computed exactly
+# from the centered ratings, as in similarity.py. The recall of the method
+# can be measured by comparing the results for a sample of movies with the
+# exact results (see recall).
+
+# Import modules
+import numpy as np
+
+import sparsesim
+
+# Prime modulus of the hash functions, (a*x + b) mod HASH_PRIME
+HASH_PRIME = (1 << 31) - 1
+# Largest number of ratings gathered at once when computing the similarity
+# coefficients of the candidate pairs
+BATCH_ENTRIES = 1 << 22
+
+# Function to list the positions covered by a set of ranges of an array,
+# given as start positions and lengths, one range after another
+def concat_ranges(starts,lengths):
+    ends = np.cumsum(lengths)
+    total = int(ends[-1]) if len(ends) > 0 else 0
+    return np.arange(total) + np.repeat(starts - (ends - lengths),lengths)
+
+# Function to find the position of each rating's user in the sorted list of
+# user ids, and the number of users
+def user_codes(store):
+    (userIds,codes) = np.unique(store.users,return_inverse=True)
+    return (codes.ravel().astype(np.int64),len(userIds))
+
+# Function to compute the MinHash signatures of the movies at the given
+# positions, with nHashes hash functions drawn from a random generator.
+# Returns an array with one row per movie and one column per hash function.
+def signatures(store,codes,movies,nHashes,rng):
+    counts = store.counts()[movies]
+    entries = concat_ranges(store.offsets[movies],counts)
+    x = codes[entries]
+    starts = np.concatenate([[0],np.cumsum(counts)[:-1]]).astype(np.int64)
+    a = rng.integers(1,HASH_PRIME,nHashes)
+    b = rng.integers(0,HASH_PRIME,nHashes)
+    sig = np.zeros((len(movies),nHashes),dtype=np.uint32)
+    for i in range(nHashes):
+        h = (a[i] * x + b[i]) % HASH_PRIME
+        sig[:,i] = np.minimum.reduceat(h,starts)
+    return sig
+
+# Function to find the candidate pairs of movies from their signatures.
+# Returns arrays of the first and second movie of each pair (as positions in
+# the store, with the first before the second), without repeats.
+def candidate_pairs(sig,movies,bands,rows,nMovies):
+    found = [np.zeros(0,dtype=np.int64)]
+    for band in range(bands):
+        keys = np.ascontiguousarray(sig[:,band*rows:(band+1)*rows])
+        keys = keys.view(np.dtype((np.void,keys.dtype.itemsize * rows)))
+        (unique,groups) = np.unique(keys.ravel(),return_inverse=True)
+        groups = groups.ravel()
+        order = np.argsort(groups,kind='stable')
+        sortedGroups = groups[order]
+        # Pair each movie with the movies d places after it in the same
+        # bucket, for every d up to the size of the largest bucket
+        d = 1
+        while d < len(order):
+            same = sortedGroups[d:] == sortedGroups[:-d]
+            if not same.any():
+                break
+            first = movies[order[:-d][same]]
+            second = movies[order[d:][same]]
+            low = np.minimum(first,second)
+            high = np.maximum(first,second)
+            found.append(low * nMovies + high)
+            d += 1
+    pairs = np.unique(np.concatenate(found))
+    return (pairs // nMovies,pairs % nMovies)
+
+# Function to compute the similarity coefficients of a list of pairs of
+# movies from the centered ratings in the store.
+# Returns arrays of the coefficient and number of shared users of each pair,
+# and a boolean array marking the pairs with at least userThresh shared
+# users and a valid coefficient.
+def pair_similarities(store,codes,nUsers,first,second,userThresh):
+    counts = store.counts()
+    sims = np.zeros(len(first))
+    nShared = np.zeros(len(first),dtype=np.int64)
+    valid = np.zeros(len(first),dtype=bool)
+    sizes = np.cumsum(counts[first] + counts[second])
+    start = 0
+    while start < len(first):
+        stop = int(np.searchsorted(sizes,sizes[start] - 1 + BATCH_ENTRIES))
+        stop = max(stop,start + 1)
+        f = first[start:stop]
+        s = second[start:stop]
+        nPairs = len(f)
+        # Label each rating with its pair, so that the ratings of the two
+        # movies of a pair by the same user have the same key
+        entries1 = concat_ranges(store.offsets[f],counts[f])
+        entries2 = concat_ranges(store.offsets[s],counts[s])
+        pair1 = np.repeat(np.arange(nPairs),counts[f])
+        pair2 = np.repeat(np.arange(nPairs),counts[s])
+        keys1 = pair1 * nUsers + codes[entries1]
+        keys2 = pair2 * nUsers + codes[entries2]
+        (common,i1,i2) = np.intersect1d(keys1,keys2,assume_unique=True,
+                                        return_indices=True)
+        groups = pair1[i1]
+        v1 = store.values[entries1[i1]]
+        v2 = store.values[entries2[i2]]
+        n = np.bincount(groups,minlength=nPairs)
+        s1 = np.bincount(groups,weights=v1 * v1,minlength=nPairs)
+        s2 = np.bincount(groups,weights=v2 * v2,minlength=nPairs)
+        s12 = np.bincount(groups,weights=v1 * v2,minlength=nPairs)
+        denominator = s1 * s2
+        ok = (n >= userThresh) & (denominator != 0)
+        sims[start:stop][ok] = s12[ok] / np.sqrt(denominator[ok])
+        nShared[start:stop] = n
+        valid[start:stop] = ok
+        start = stop
+    return (sims,nShared,valid)
+
+# Function to find approximately the topK most similar movies to each movie,
+# using MinHash signatures with the given numbers of bands and rows.
+# Returns a dictionary in the form returned by sparsesim.top_matches, and the
+# number of candidate pairs.
+def top_matches(store,userThresh,topK,bands,rows,seed=None):
+    rng = np.random.default_rng(seed)
+    (codes,nUsers) = user_codes(store)
+    # Movies with fewer ratings than the user threshold cannot have a valid
+    # pair
+    movies = np.nonzero(store.counts() >= max(userThresh,1))[0]
+    if len(movies) == 0:
+        return (dict(),0)
+    sig = signatures(store,codes,movies,bands * rows,rng)
+    (first,second) = candidate_pairs(sig,movies,bands,rows,len(store))
+    (sims,nShared,valid) = pair_similarities(store,codes,nUsers,first,second,
+                                             userThresh)
+    rowsFound = np.concatenate([first[valid],second[valid]])
+    cols = np.concatenate([second[valid],first[valid]])
+    matches = sparsesim.merge_candidates(
+        store.movieIds.tolist(),
+        [(rowsFound,cols,np.tile(sims[valid],2),np.tile(nShared[valid],2))],
+        topK)
+    return (matches,len(first))
+
+# Function to find the exact topK most similar movies to each of the movies
+# at the given positions, by comparing each with every other movie.
+# Returns a dictionary in the form returned by sparsesim.top_matches.
+def exact_matches(store,movies,userThresh,topK):
+    userIdx = store.user_index()
+    candidates = [(np.zeros(0,dtype=np.int64),np.zeros(0,dtype=np.int64),
+                   np.zeros(0),np.zeros(0,dtype=np.int64))]
+    for movie1 in movies:
+        (others,pos1,pos2) = store.co_ratings(userIdx,movie1)
+        (movies2,groups,n) = np.unique(others,return_inverse=True,
+                                       return_counts=True)
+        v1 = store.values[pos1]
+        v2 = store.values[pos2]
+        s1 = np.bincount(groups,weights=v1 * v1,minlength=len(movies2))
+        s2 = np.bincount(groups,weights=v2 * v2,minlength=len(movies2))
+        s12 = np.bincount(groups,weights=v1 * v2,minlength=len(movies2))
+        denominator = s1 * s2
+        ok = (n >= userThresh) & (denominator != 0)
+        candidates.append((np.full(np.count_nonzero(ok),movie1),movies2[ok],
+                           s12[ok] / np.sqrt(denominator[ok]),n[ok]))
+    matches = sparsesim.merge_candidates(store.movieIds.tolist(),candidates,
+                                         topK)
+    return matches
+
+# Function to measure the recall of approximate results on a random sample
+# of movies: the fraction of the exact topK most similar movies that are
+# also in the approximate results, over the sampled movies with any valid
+# pair.
+# Returns the recall (or None if no sampled movie has a valid pair) and the
+# number of sampled movies.
+def recall(store,matches,userThresh,topK,sampleSize,seed=None):
+    rng = np.random.default_rng(seed)
+    sampleSize = min(sampleSize,len(store))
+    movies = np.sort(rng.choice(len(store),sampleSize,replace=False))
+    exact = exact_matches(store,movies,userThresh,topK)
+    found = 0
+    total = 0
+    for (movie,exactList) in exact.items():
+        wanted = set(m for (m,sim,n) in exactList)
+        got = set(m for (m,sim,n) in matches.get(movie,[]))
+        found += len(wanted & got)
+        total += len(wanted)
+    if total == 0:
+        return (None,sampleSize)
+    return (found / total,sampleSize)
@@ -0,0 +1,256 @@
+# This module reads a MovieLens ratings file into three arrays holding the
+# user id, movie id, and rating of each valid line, in the order of the file.
+# Parsing the text is slow, so the arrays are saved in a cache directory as
+# .npy files the first time a file is read, and later runs memory-map them
+# instead. The cache records the size, modification time, and SHA-1 hash of
+# the ratings file, and is only used if it matches the current file. When the
+# size and modification time match the file is not read at all; otherwise
+# the file is hashed, so a cache still matches a file that was copied or
+# touched without being changed.
+#
+# Lines follow the rules of similarity.py: a line is skipped if its user id,
+# movie id, or rating is not a number (or it has fewer than three values),
+# but it is still counted in the number of lines read.
+#
+# The arrays can then be arranged into a RatingsStore, which holds the ratings
+# of each movie in compressed sparse row form.
+
+# Import modules
+import array
+import hashlib
+import json
+import os
+
+import numpy as np
+
+# Version of the cache format, stored in the cache so that caches written in
+# an older format are not used
+CACHE_VERSION = 1
+# Names of the arrays stored in the cache
+COLUMNS = ['users','movies','ratings']
+
+# Function to get the size and modification time of a file
+def file_stamp(fileName):
+    info = os.stat(fileName)
+    return (info.st_size,info.st_mtime_ns)
+
+# Function to get the SHA-1 hash of a file
+def file_hash(fileName):
+    h = hashlib.sha1()
+    with open(fileName,'rb') as f:
+        for block in iter(lambda: f.read(1 << 20),b""):
+            h.update(block)
+    return h.hexdigest()
+
+# Function to parse a ratings file.
+# Returns a tuple of the user ids, movie ids, and ratings as arrays, and the
+# number of lines in the file (including skipped lines).
+def parse_ratings(fileName):
+    users = array.array('q')
+    movies = array.array('q')
+    ratings = array.array('d')
+    lines = 0
+    with open(fileName,'r') as f:
+        for line in f:
+            lines += 1
+            entry = line.split()
+            try:
+                user = int(entry[0])
+                movie = int(entry[1])
+                rating = float(entry[2])
+            except (ValueError,IndexError):
+                continue
+            users.append(user)
+            movies.append(movie)
+            ratings.append(rating)
+    return (np.frombuffer(users,dtype=np.int64),
+            np.frombuffer(movies,dtype=np.int64),
+            np.frombuffer(ratings,dtype=np.float64),lines)
+
+# Function to read the metadata of a cache directory, or None if there is no
+# complete cache there
+def read_meta(cacheDir):
+    try:
+        with open(os.path.join(cacheDir,"meta.json"),'r') as f:
+            meta = json.load(f)
+    except (OSError,ValueError):
+        return None
+    if meta.get('version') != CACHE_VERSION:
+        return None
+    return meta
+
+# Function to write a cache directory.
+# The metadata is written last, and removed first, so a cache that was only
+# partly written is never used.
+def write_cache(cacheDir,meta,columns):
+    os.makedirs(cacheDir,exist_ok=True)
+    metaFile = os.path.join(cacheDir,"meta.json")
+    if os.path.exists(metaFile):
+        os.remove(metaFile)
+    for (name,values) in zip(COLUMNS,columns):
+        np.save(os.path.join(cacheDir,name + ".npy"),values)
+    with open(metaFile + ".tmp",'w') as f:
+        json.dump(meta,f)
+    os.replace(metaFile + ".tmp",metaFile)
+
+# Function to load a ratings file, using or updating the cache in cacheDir.
+# If cacheDir is None, the file is parsed without a cache. If the cache
+# cannot be written (for example, the directory is read-only), the parsed
+# arrays are still returned.
+# Returns a tuple of the user ids, movie ids, and ratings as arrays (which
+# are read-only when they come from the cache), and the number of lines in
+# the file.
+def load_ratings(fileName,cacheDir=None):
+    if cacheDir is None:
+        return parse_ratings(fileName)
+    (size,mtime) = file_stamp(fileName)
+    meta = read_meta(cacheDir)
+    digest = None
+    if meta is not None and meta['size'] == size and meta['mtime'] != mtime:
+        # The file may have been touched or copied without changing
+        digest = file_hash(fileName)
+        if digest == meta['sha1']:
+            meta['mtime'] = mtime
+            metaFile = os.path.join(cacheDir,"meta.json")
+            try:
+                with open(metaFile + ".tmp",'w') as f:
+                    json.dump(meta,f)
+                os.replace(metaFile + ".tmp",metaFile)
+            except OSError:
+                pass
+    if meta is not None and meta['size'] == size and meta['mtime'] == mtime:
+        columns = []
+        for name in COLUMNS:
+            columns.append(np.load(os.path.join(cacheDir,name + ".npy"),
+                                   mmap_mode='r'))
+        return tuple(columns) + (meta['lines'],)
+    if digest is None:
+        digest = file_hash(fileName)
+    (users,movies,ratings,lines) = parse_ratings(fileName)
+    meta = {'version': CACHE_VERSION, 'size': size, 'mtime': mtime,
+            'sha1': digest, 'lines': lines}
+    try:
+        write_cache(cacheDir,meta,(users,movies,ratings))
+    except OSError:
+        pass
+    return (users,movies,ratings,lines)
+
+# Function to choose the smallest signed integer type that can hold values
+# from low to high
+def index_dtype(low,high):
+    info = np.iinfo(np.int32)
+    if low >= info.min and high <= info.max:
+        return np.int32
+    return np.int64
+
+# Class holding the ratings of each movie in compressed sparse row form.
+# The movies are numbered by position, in the order in which they first
+# appear in the ratings file (the order in which similarity.py used to add
+# them to its dictionary). The ratings of movie i are at positions
+# offsets[i] to offsets[i+1] of the users and values arrays, sorted by user
+# id. Each rating takes 12 bytes: a 4-byte user id (8 bytes if the ids do
+# not fit in 32 bits) and an 8-byte value.
+#
+# Attributes:
+#   movieIds: array of the id of each movie
+#   offsets: array of the start of each movie's ratings, plus the total
+#   users: array of the user id of each rating
+#   values: array of the value of each rating, which can be changed in place
+#           (for example, to subtract the average of each movie)
+class RatingsStore:
+    def __init__(self,movieIds,offsets,users,values):
+        self.movieIds = movieIds
+        self.offsets = offsets
+        self.users = users
+        self.values = values
+
+    # Function to build a store from arrays of the user id, movie id, and
+    # rating of each line, as returned by load_ratings.
+    # If a user rated a movie more than once, the last rating is kept.
+    @classmethod
+    def from_columns(cls,users,movies,ratings):
+        n = len(users)
+        (uniqueMovies,first,inverse) = np.unique(movies,return_index=True,
+                                                 return_inverse=True)
+        # Number the movies in the order they first appear
+        order = np.argsort(first)
+        rank = np.empty(len(order),dtype=np.int64)
+        rank[order] = np.arange(len(order))
+        movieRank = rank[inverse.ravel()]
+        # Sort the ratings by movie, then user, then line, and keep the last
+        # line of each movie and user
+        sortIdx = np.lexsort((np.arange(n),users,movieRank))
+        sortedMovies = movieRank[sortIdx]
+        sortedUsers = users[sortIdx]
+        last = np.ones(n,dtype=bool)
+        last[:-1] = ((sortedMovies[1:] != sortedMovies[:-1]) |
+                     (sortedUsers[1:] != sortedUsers[:-1]))
+        keep = sortIdx[last]
+        offsets = np.zeros(len(order) + 1,dtype=np.int64)
+        np.cumsum(np.bincount(movieRank[keep],minlength=len(order)),
+                  out=offsets[1:])
+        userType = np.int32
+        if n > 0:
+            userType = index_dtype(users.min(),users.max())
+        return cls(uniqueMovies[order],offsets,users[keep].astype(userType),
+                   np.array(ratings[keep],dtype=np.float64))
+
+    # Function to get the number of movies
+    def __len__(self):
+        return len(self.movieIds)
+
+    # Function to get the number of ratings of each movie
+    def counts(self):
+        return np.diff(self.offsets)
+
+    # Function to build an index of the movies rated by each user.
+    # The index is a tuple of the sorted user ids, the start of each user's
+    # entries (plus the total), and for each entry the position of the movie
+    # and the position of the rating in the store. Each user's entries are in
+    # order of movie position.
+    def user_index(self):
+        (userIds,codes) = np.unique(self.users,return_inverse=True)
+        codes = codes.ravel()
+        order = np.argsort(codes,kind='stable')
+        userOffsets = np.zeros(len(userIds) + 1,dtype=np.int64)
+        np.cumsum(np.bincount(codes,minlength=len(userIds)),
+                  out=userOffsets[1:])
+        movieType = index_dtype(0,len(self))
+        positions = np.repeat(np.arange(len(self),dtype=movieType),
+                              self.counts())
+        posType = index_dtype(0,len(self.values))
+        return (userIds,userOffsets,positions[order],order.astype(posType))
+
+    # Function to find every rating of another movie by a user who also rated
+    # the movie at the given position, using the index from user_index.
+    # Returns arrays with, for each such rating, the position of the other
+    # movie, the position of the given movie's rating by the same user, and
+    # the position of the other movie's rating.
+    def co_ratings(self,userIdx,movie):
+        (userIds,userOffsets,userMovies,userPos) = userIdx
+        start = self.offsets[movie]
+        stop = self.offsets[movie+1]
+        rows = np.searchsorted(userIds,self.users[start:stop])
+        starts = userOffsets[rows]
+        lengths = userOffsets[rows+1] - starts
+        # Concatenate the index entries of each of the movie's users
+        ends = np.cumsum(lengths)
+        total = int(ends[-1]) if len(ends) > 0 else 0
+        entries = np.arange(total) + np.repeat(starts - (ends - lengths),
+                                               lengths)
+        others = userMovies[entries]
+        other = others != movie
+        pos1 = np.repeat(np.arange(start,stop),lengths)
+        return (others[other],pos1[other],userPos[entries][other])
+
+    # Function to get the arrays of the user id, movie id, and rating of each
+    # rating, in the form returned by load_ratings. The ratings are in order
+    # of movie position, so a store built from these arrays has its movies
+    # in the same order.
+    def columns(self):
+        return (self.users,np.repeat(self.movieIds,self.counts()),self.values)
+
+    # Function to get the number of bytes used by the arrays
+    def nbytes(self):
+        return (self.movieIds.nbytes + self.offsets.nbytes +
+                self.users.nbytes + self.values.nbytes)
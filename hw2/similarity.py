@@ -1,254 +1,441 @@
 # This program takes in a data file containing movie ratings from an assortment
 # of users, and calculates the similarity coefficients of the movies. The data
-# is read from the file and placed in a dictionary. It is then processed to
+# is read from the file and placed in arrays holding the ratings of each
+# movie, sorted by user (see ratings.py). It is then processed to
 # subtract the average rating for each movie from each individual rating.
-# Next, the program goes through each potential pair of movies, finds the
-# user that rated both movies, and calculates the similarity coefficient if
-# there is enough overlap, placing the results in a new dictionary. A second
-# dictionary is used to keep track of pairs that have already been processed
-# to avoid wasting time on duplicate calculations. Finally, the most similar
-# movie to each movie is determined, and the original movie, secondary movie,
-# similarity coefficient, and number of shared users are written to a file.
+# Next, the program builds an index of the movies rated by each user, and
+# uses it to count the users shared by each pair of movies that have any
+# users in common. The similarity coefficient is calculated for each pair
+# with enough overlap, and only the most similar movies to each movie are
+# kept. Pairs with no shared users are never looked at. Finally, the original
+# movie, the most similar movie (or movies), the similarity coefficient, and
+# the number of shared users are written to a file.
 
 # Import modules
+import heapq
+import os
 import sys
 import time
 
-# Function to take dictionary of ratings
-# and return a dictionary with each movie's average rating
-def movie_average(moviesDict):
-    # Create empty dictionary
-    averageRating = dict()
-    # For each movie, iterate through values in sub-dictionary and add rating.
-    # Then divide by number of revies of each movie to find average rating.
-    for movie in moviesDict:
-        sum = 0.0
-        for r in moviesDict[movie].values():
-            sum += r
-        averageRating[movie] = sum/len(moviesDict[movie])
-    return averageRating
-
-# Function to take dictionary of ratings and dictionary of average ratings,
+import numpy as np
+
+import incremental
+import metrics
+import minhash
+import ratings
+import sparsesim
+
+# Function to take the store of ratings (see ratings.py)
+# and return an array with each movie's average rating
+def movie_average(store):
+    # Add up the ratings of each movie, then divide by the number of reviews
+    # of each movie to find the average rating.
+    if len(store) == 0:
+        return np.zeros(0)
+    sums = np.add.reduceat(store.values,store.offsets[:-1])
+    return sums/store.counts()
+
+# Function to take the store of ratings and array of average ratings,
 # and subtract average ratings from raw ratings.
-# This changes the original dictionary rather than creating a new one.
-def deviation(moviesDict,avgDict):
-    # Iterate through dictionary, subtracting the average value for each movie
-    # from the raw rating
-    for movie in moviesDict:
-        average = avgDict[movie]
-        for user in moviesDict[movie]:
-            moviesDict[movie][user] -= average
-
-# Function to take dictionary of ratings and two movie ids
-# and return a set with all user ids that rated both movies
-def overlap(moviesDict,movie1,movie2):
-    # Create sets with the ids for all users who rated each movie
-    users1 = set(moviesDict[movie1].keys())
-    users2 = set(moviesDict[movie2].keys())
-    # Find and return the intersection between the two sets
-    shared = users1.intersection(users2)
-    return shared
-
-# Function to find sum of a list of values squared
-def sum_squares(moviesDict,movie,shared):
-    # Cycle through the set of shared users,
-    # adding the square of their rating's deviation from average
-    sum = 0.0
-    for user in shared:
-        sum += moviesDict[movie][user] ** 2
-    return sum
-
-# Function to find sum of products of shared movie ratings
-def sum_products(moviesDict,movie1,movie2,shared):
-    # Cycle through set of shared users,
-    # adding the product of the deviations of their ratings
-    # for each movie from the respective averages
-    sum = 0.0
-    for user in shared:
-        r1 = moviesDict[movie1][user]
-        r2 = moviesDict[movie2][user]
-        sum += r1 * r2
-    return sum
+# This changes the original store rather than creating a new one.
+def deviation(store,averages):
+    store.values -= np.repeat(averages,store.counts())
+
+# Function to take the store of ratings, the user index (see
+# ratings.RatingsStore.user_index), and a movie's position, and find every
+# rating of a later movie by a user who also rated the given movie.
+# Returns arrays with, for each such rating, the position of the other movie,
+# the position of the given movie's rating by the same user, and the
+# position of the other movie's rating.
+def overlap(store,userIdx,movie1):
+    (others,pos1,pos2) = store.co_ratings(userIdx,movie1)
+    later = others > movie1
+    return (others[later],pos1[later],pos2[later])
+
+# Function to count the users shared with each other movie, given the other
+# movie of each shared rating (from overlap).
+# Returns the positions of the other movies, the number of shared users of
+# each, and for each shared rating the index of its movie in the first array.
+def shared_counts(others):
+    (movies2,groups,nShared) = np.unique(others,return_inverse=True,
+                                         return_counts=True)
+    return (movies2,nShared,groups)
+
+# Function to find sums of the squares of ratings for groups of shared users.
+# The group of each rating is given by its index in groups.
+def sum_squares(store,positions,groups,nGroups):
+    # Add the square of each rating's deviation from average to its group
+    values = store.values[positions]
+    return np.bincount(groups,weights=values * values,minlength=nGroups)
+
+# Function to find sums of products of shared movie ratings for groups of
+# shared users
+def sum_products(store,pos1,pos2,groups,nGroups):
+    # Add the product of the deviations of the ratings for each movie from
+    # the respective averages to its group
+    values = store.values[pos1] * store.values[pos2]
+    return np.bincount(groups,weights=values,minlength=nGroups)
+
+# Function to offer a similar movie to the heap of a movie's most similar
+# movies, keeping at most topK of them.
+# Each heap entry is a tuple of the similarity coefficient, the negative of
+# the other movie's position in the store, the other movie's id, and the
+# number of shared users. The heap's first entry is the least similar movie
+# kept, and among movies with the same similarity coefficient the one that
+# comes last in the store counts as less similar. The movie kept when there
+# is a tie is therefore the one max() and index() would pick from a list of
+# the results in order of the movies' first appearance in the data file.
+def add_neighbor(heap,topK,sim,rank,movie,nShared):
+    entry = (sim,-rank,movie,nShared)
+    if len(heap) < topK:
+        heapq.heappush(heap,entry)
+    elif entry > heap[0]:
+        heapq.heapreplace(heap,entry)
+
+# Function to make the line of the output file for a movie, with the most
+# similar movies found for it (if any)
+def output_line(movie1,topMatches):
+    line = str(movie1)
+    # If there are no paired movies, do nothing, leaving the rest of the
+    # line blank.
+    if movie1 in topMatches:
+        for match in topMatches[movie1]:
+            line += " ({},{},{})".format(*match)
+    return line
+
+# Function to find the name of the output file for a similarity measure, by
+# adding the measure's name before the extension of the output file
+def metric_file(outputFile,name):
+    (root,ext) = os.path.splitext(outputFile)
+    return root + "." + name + ext
 
 # Check for correct number of user inputs,
 # and print usage message if inputs are inadequate
-if len(sys.argv) < 3:
+# Options are given as pairs of a name and a value, and can come after the
+# other inputs.
+options = {'engine': 'dict', 'topk': '1', 'workers': '1', 'cache': None,
+           'state': None, 'update': None, 'bands': '32', 'rows': '4',
+           'seed': '0', 'recall-sample': '100', 'metrics': None}
+args = []
+i = 1
+while i < len(sys.argv):
+    if sys.argv[i].startswith("--") and sys.argv[i][2:] in options:
+        if i + 1 == len(sys.argv):
+            print("ERROR: option {} has no value".format(sys.argv[i]))
+            sys.exit(2)
+        options[sys.argv[i][2:]] = sys.argv[i+1]
+        i += 2
+    else:
+        args.append(sys.argv[i])
+        i += 1
+if len(args) < 2:
     print("Usage:")
     usage1 = "  $ python3 similarity.py <data_file>"
-    usage2 = " <output_file> [user_thresh (default = 5)]"
+    usage2 = " <output_file> [user_thresh (default = 5)] [options]"
     print(usage1 + usage2)
+    print("Options:")
+    print("  --engine <dict|sparse|lsh>")
+    print("                          method used to compute similarities")
+    print("                          (default = dict); lsh only compares")
+    print("                          likely pairs, found with MinHash")
+    print("  --topk <K>              number of most similar movies to list for")
+    print("                          each movie (default = 1)")
+    print("  --workers <N>           number of processes used by the sparse")
+    print("                          engine (default = 1)")
+    print("  --cache <dir|none>      directory for the binary copy of the data")
+    print("                          file (default = <data_file>.cache)")
+    print("  --state <dir>           save the state needed to update the results")
+    print("                          in a directory")
+    print("  --update <dir>          add the ratings in <data_file> to the state")
+    print("                          saved in a directory, and update the lines")
+    print("                          of <output_file> that change")
+    print("  --bands <B>             number of LSH bands (default = 32)")
+    print("  --rows <R>              number of MinHash values in each LSH band")
+    print("                          (default = 4)")
+    print("  --seed <seed>           seed for the MinHash functions and the")
+    print("                          recall sample (default = 0)")
+    print("  --recall-sample <N>     number of movies used to measure the recall")
+    print("                          of the lsh engine, or 0 (default = 100)")
+    print("  --metrics <m1,m2,...>   similarity measures to compute, from")
+    print("                          {}; each".format(",".join(metrics.METRICS)))
+    print("                          is written to <output_file> with the")
+    print("                          measure's name added before the extension")
     sys.exit(0)
+if options['engine'] not in ('dict','sparse','lsh'):
+    print("ERROR: unknown engine {}".format(options['engine']))
+    sys.exit(2)
+topK = int(options['topk'])
+if topK < 1:
+    print("ERROR: --topk must be at least 1")
+    sys.exit(2)
+workers = int(options['workers'])
+if workers < 1:
+    print("ERROR: --workers must be at least 1")
+    sys.exit(2)
+if workers > 1 and options['engine'] != 'sparse':
+    print("ERROR: --workers can only be used with --engine sparse")
+    sys.exit(2)
+if options['state'] is not None and options['update'] is not None:
+    print("ERROR: --state and --update cannot be used together")
+    sys.exit(2)
+stateDir = options['state']
+updating = options['update'] is not None
+if updating:
+    stateDir = options['update']
+if stateDir is not None and options['engine'] != 'dict':
+    print("ERROR: --state and --update can only be used with --engine dict")
+    sys.exit(2)
+metricNames = None
+if options['metrics'] is not None:
+    metricNames = options['metrics'].split(",")
+    for name in metricNames:
+        if name not in metrics.METRICS:
+            print("ERROR: unknown similarity measure {}".format(name))
+            sys.exit(2)
+    if options['engine'] != 'dict' or updating:
+        print("ERROR: --metrics can only be used with --engine dict, and not")
+        print("       with --update")
+        sys.exit(2)
 # Record input arguments. If a user threshold is specified, use that;
 # if not, set default of 5
-dataFile = sys.argv[1]
-outputFile = sys.argv[2]
-if len(sys.argv) == 4:
-    userThresh = int(sys.argv[3])
+dataFile = args[0]
+outputFile = args[1]
+if len(args) == 3:
+    userThresh = int(args[2])
 else:
     userThresh = 5
+cacheDir = options['cache']
+if cacheDir is None and not updating:
+    cacheDir = dataFile + ".cache"
+elif cacheDir == "none":
+    cacheDir = None
+# When updating, the user threshold and number of similar movies are the
+# ones the state was saved with
+if updating:
+    try:
+        state = incremental.SimilarityState.load(stateDir)
+    except RuntimeError as e:
+        print("ERROR: {}".format(e))
+        sys.exit(2)
+    if len(args) == 3 and userThresh != state.userThresh:
+        print("ERROR: the state was saved with a user threshold of {}"
+              .format(state.userThresh))
+        sys.exit(2)
+    userThresh = state.userThresh
+    topK = state.topK
 
-# Read data file and convert to a dictionary.
-# The keys for each dictionary are each movie ID.
-# The value for each item is another dictionary.
-# For each sub-dictionary, the key is the user ID
-# and the value is the rating given to the movie by the user.
+# Read data file and convert to a store of the ratings of each movie.
+# The file is read into arrays of the user id, movie id, and rating on each
+# line by ratings.py, which keeps a binary copy of the arrays in the cache
+# directory so later runs do not parse the text again. Lines with a value
+# that is not a number are skipped, although they still add to the line
+# counter.
+# The store holds the user ids and ratings of each movie in arrays sorted by
+# user id, with the movies in the order they first appear in the file (see
+# ratings.RatingsStore).
+# When updating, the data file holds new ratings, which are added to the
+# store saved in the state.
 t1=time.time()
-moviesDict = dict()
-lines = 0
-userIds = set()
-with open(dataFile,'r') as f:
-    # Iterate through each line of the data file,
-    # converting each line into a list with entries representing user id,
-    # movie id, rating, and timestamp (which is subsequently ignored)
-    for line in f:
-        lines += 1
-        entry = []
-        for value in line.split():
-            entry.append(value)
-        # Create variables to keep track of each value.
-        # These are converted to integers to assist with later sorting.
-        # If any value is not a number, the program responds by catching the
-        # resulting ValueError and skipping over the line (although it still
-        # adds to the line counter).
-        try:
-            user = int(entry[0])
-            movie = int(entry[1])
-            rating = float(entry[2])
-            userIds.add(user)
-            # If movie already is represented in the dictionary,
-            # add the user and rating to its sub-dictionary.
-            # If not, create a new sub-dictionary for the movie,
-            # using the given user and rating.
-            if movie in moviesDict:
-                moviesDict[movie][user] = rating
-            else:
-                moviesDict[movie]={user: rating}
-        except ValueError:
-            continue
-
-# Find the average rating for each movie
+(users,movies,values,lines) = ratings.load_ratings(dataFile,cacheDir)
+if updating:
+    changedMovies = state.update(users,movies,values)
+    store = state.store
+else:
+    store = ratings.RatingsStore.from_columns(users,movies,values)
+del users,movies,values
+
+# Find the average rating for each movie.
+# The state and the similarity measures keep the raw ratings, and work out
+# the deviations themselves, so this is only needed by the other engines.
+centering = stateDir is None and metricNames is None
 t2 = time.time()
-averageRating = movie_average(moviesDict)
-# Convert dictionary from raw ratings to deviation from average rating
+if centering:
+    averageRating = movie_average(store)
+# Convert the store from raw ratings to deviation from average rating
 t3 = time.time()
-deviation(moviesDict,averageRating)
+if centering:
+    deviation(store,averageRating)
 
-# Go through the dictionary, and determine the similarity coefficients for
+# Go through the store, and determine the similarity coefficients for
 # each pair of movies.
-# The data is stored in a dictionary, with values of the movie ids
-# and values of tuples storing results.
-# The tuples contain three lists: the ids of movies with enough shared users,
-# the simiaritiy coefficients, and the numbers of shared users.
-# These lists are all in the same order (i.e. the second similarity coefficient
-# refers to the second paired movie).
-# This structure allows for the results for each movie to be considered
-# separately, and for the maximum similarity coefficient to be easily identified
-# and linked to its corresponding movie id and number of shared users
+# Only the topK most similar movies to each movie are kept. They are stored
+# in a list with a heap for each movie (see add_neighbor) holding at most
+# topK results, so the memory used depends on the number of movies rather
+# than the number of pairs.
 #
-# Additionally, a second dictionary is used to keep track of the movie pairs
-# whose similarities have already been calculated to avoid duplicate analysis
-# (such as finding movie 1's similarity to movie 2, then movie 2's similarity
-# to movie 1).
-# The keys in this second dictionary are tuples with the first movie id
-# and the second movie id.
-# The values are lists with the similarity coefficient and number of
-# shared users.
-# This structure allows for specific pairs to be checked, and the result of
-# each pair to be easily found.
+# The candidate pairs come from an index of the movies rated by each user
+# (see ratings.py and overlap), so pairs of movies with no users in common
+# are never looked at. Each movie is compared with the later movies in the
+# store at once: the shared users of each pair are counted, and the sums for
+# the similarity coefficient are found for the pairs with enough shared
+# users. Each pair is only looked at once, and its result is offered to the
+# heaps of both movies.
 #
 # If there is insufficient data to find the similarity coefficient of two
-# movies, the pair is not added to the first dictionary, and the list of
-# results in the second dictionary is left blank.
+# movies, the pair is not added to either heap.
+#
+# With --state or --update, the similarity coefficients are found from sums
+# of the raw ratings over the shared users of each pair, which are saved so
+# that new ratings only need the pairs of the movies they rate to be looked
+# at again (see incremental.py). When updating, only the best matches of the
+# movies whose results may have changed are found.
+#
+# With --metrics, the same sums are found for every pair with enough shared
+# users in one pass, and each similarity measure is worked out from them
+# (see metrics.py).
 t4 = time.time()
-similarDict = dict()
-completedPairs = dict()
-for movie1 in moviesDict:
-    # set up entry in dictionary
-    similarDict[movie1] = ([],[],[])
-    for movie2 in moviesDict:
-        # Ignore all cases where movie is repeated
-        if movie1 == movie2:
-            continue
-        # Check to see if the movie pair's similarity has already been
-        # calculated. If so, and there is a valid result, the result is entered
-        # into the dictionary. If the previous calculation did not produce a
-        # valid result, nothing happens.
-        # There is no need to enter this pair into the dictionary of completed
-        # pairs, as it cannot come up a third time.
-        elif (movie2,movie1) in completedPairs:
-            if len(completedPairs[(movie2,movie1)]) > 0:
-                similarDict[movie1][0].append(movie2)
-                prior = completedPairs[(movie2,movie1)]
-                similarDict[movie1][1].append(prior[0])
-                similarDict[movie1][2].append(prior[1])
-        # If the pair has not been previously determined, find a set of the
-        # shared users.
-        else:
-            shared = overlap(moviesDict,movie1,movie2)
-            nShared = len(shared)
-            # If there are not enough shared users, add a blank record of the
-            # pair to the dictionary of completed pairs, and add nothing to
-            # the results dictionary.
-            if nShared < userThresh:
-                completedPairs[(movie1,movie2)]=[]
-            # If there are enough shared users, calculate the similarity
-            # as given in the assignment.
-            else:
-                s1 = sum_squares(moviesDict,movie1,shared)
-                s2 = sum_squares(moviesDict,movie2,shared)
-                # If the denominator is zero, there is no variation in the
-                # ratings for one of the movies, and thus not enough information
-                # to calculate the similarity coefficient, so a blank entry
-                # is added to the completed pairs dictionary and nothing is
-                # added to the results dictionary.
-                if (s1 * s2) == 0:
-                    completedPairs[(movie1,movie2)]=[]
-                else:
-                    s12 = sum_products(moviesDict,movie1,movie2,shared)
-                    sim12 = s12 / ((s1 * s2) ** (0.5))
-                    # Second movie id, similarity coefficient, and number of
-                    # shared users are appended to the correct lists,
-                    # and the results are placed in the completed pairs
-                    # dictionary
-                    similarDict[movie1][0].append(movie2)
-                    similarDict[movie1][1].append(sim12)
-                    similarDict[movie1][2].append(nShared)
-                    completedPairs[(movie1,movie2)] = [sim12,nShared]
+# The sparse engine finds the best matches for each movie directly, using
+# sparse matrix products (see sparsesim.py), which can be shared out between
+# several worker processes. The default (dict) engine compares
+# each pair of movies as described above.
+movieIds = store.movieIds.tolist()
+if updating:
+    if os.path.exists(outputFile):
+        topMatches = state.top_matches(changedMovies)
+    else:
+        # There is no earlier output to keep the other movies' lines from,
+        # so the best matches of every movie are needed
+        topMatches = state.top_matches()
+    state.save(stateDir)
+elif metricNames is not None:
+    if stateDir is not None:
+        state = incremental.SimilarityState.build(store,userThresh,topK)
+        state.save(stateDir)
+        (pairs,sums,counts) = (state.pairs,state.sums,state.counts)
+    else:
+        inSet = np.ones(len(store),dtype=bool)
+        pairs = incremental.pair_sums(store,store.user_index(),inSet,
+                                      userThresh)
+        (sums,sumsq,counts) = incremental.movie_sums(store,
+                                                     np.arange(len(store)))
+    metricMatches = metrics.top_matches(metricNames,pairs,sums,counts,
+                                        movieIds,topK)
+elif stateDir is not None:
+    state = incremental.SimilarityState.build(store,userThresh,topK)
+    topMatches = state.top_matches()
+    state.save(stateDir)
+elif options['engine'] == 'sparse':
+    topMatches = sparsesim.top_matches(store,userThresh,topK,workers)
+elif options['engine'] == 'lsh':
+    (topMatches,nCandidates) = minhash.top_matches(store,userThresh,topK,
+                                                   int(options['bands']),
+                                                   int(options['rows']),
+                                                   int(options['seed']))
+else:
+    userIdx = store.user_index()
+    neighbors = []
+    for movie1 in range(len(store)):
+        # set up entry in list
+        neighbors.append([])
+    for movie1 in range(len(store)):
+        # Count the shared users of every later movie with any in common,
+        # and keep the movies with enough shared users
+        (others,pos1,pos2) = overlap(store,userIdx,movie1)
+        (movies2,nShared,groups) = shared_counts(others)
+        enough = nShared >= userThresh
+        keep = enough[groups]
+        movies2 = movies2[enough]
+        nShared = nShared[enough]
+        groups = (np.cumsum(enough) - 1)[groups[keep]]
+        pos1 = pos1[keep]
+        pos2 = pos2[keep]
+        # Calculate the similarities as given in the assignment.
+        s1 = sum_squares(store,pos1,groups,len(movies2))
+        s2 = sum_squares(store,pos2,groups,len(movies2))
+        s12 = sum_products(store,pos1,pos2,groups,len(movies2))
+        # If the denominator is zero, there is no variation in the ratings
+        # for one of the movies, and thus not enough information to
+        # calculate the similarity coefficient, so the pair is skipped.
+        denominator = s1 * s2
+        valid = denominator != 0
+        sims = s12[valid] / np.sqrt(denominator[valid])
+        for (movie2,sim12,n) in zip(movies2[valid].tolist(),sims.tolist(),
+                                    nShared[valid].tolist()):
+            # The result is offered to the heaps of both movies
+            add_neighbor(neighbors[movie1],topK,sim12,movie2,movieIds[movie2],
+                         n)
+            add_neighbor(neighbors[movie2],topK,sim12,movie1,movieIds[movie1],
+                         n)
+
+    # For each movie with any sufficiently similar movies, list the kept
+    # movie ids, similarity coefficients, and numbers of shared users, most
+    # similar first.
+    topMatches = dict()
+    for movie1 in range(len(store)):
+        if len(neighbors[movie1]) >= 1:
+            best = sorted(neighbors[movie1],reverse=True)
+            topMatches[movieIds[movie1]] = [
+                (movie2,sim,nCommon) for (sim,negRank,movie2,nCommon) in best]
 
 # Create a sorted list of all movie ids to use when writing the results to
 # a file
 t5 = time.time()
-movieIds = list(similarDict.keys())
 movieIdsSorted = sorted(movieIds)
 
 # Write the movie ids to a file, accompanied by the most similar movie,
 # the similarity coefficient, and the number of shared users, if there is
-# at least one sufficiently similar movie.
-with open(outputFile,'w') as f:
-    for movie1 in movieIdsSorted:
-        f.write(str(movie1))
-        movieResults = similarDict[movie1]
-        # If any movies have enough shared users, find the highest similarity
-        # coefficient and the corresponding movie id and number of shared
-        # users and write these to the file. If there are no paired movies,
-        # do nothing, leaving the rest of the line blank.
-        if len(movieResults[0]) >= 1:
-            value = max(movieResults[1])
-            loc = movieResults[1].index(value)
-            movie2 = movieResults[0][loc]
-            nCommon = movieResults[2][loc]
-            f.write(" ({},{},{})".format(movie2,value,nCommon))
-        # add a line break between movies
-        f.write("\n")
+# at least one sufficiently similar movie. With a topK above 1, the other
+# kept movies follow in the same form, from most to least similar.
+# When updating, the lines of the movies whose results were not found again
+# are kept from the existing output file, and the file is replaced once the
+# new one is complete.
+# With --metrics, a file is written for each similarity measure.
+if metricNames is None:
+    outputs = [(outputFile,topMatches)]
+else:
+    outputs = [(metric_file(outputFile,name),metricMatches[name])
+               for name in metricNames]
+for (fileName,topMatches) in outputs:
+    outputLines = dict()
+    if updating and os.path.exists(fileName):
+        with open(fileName,'r') as f:
+            for line in f:
+                line = line.rstrip("\n")
+                outputLines[int(line.split()[0])] = line
+    else:
+        changedMovies = range(len(movieIds))
+    changedLines = 0
+    for movie1 in changedMovies:
+        line = output_line(movieIds[movie1],topMatches)
+        if outputLines.get(movieIds[movie1]) != line:
+            outputLines[movieIds[movie1]] = line
+            changedLines += 1
+    with open(fileName + ".tmp",'w') as f:
+        for movie1 in movieIdsSorted:
+            f.write(outputLines[movie1])
+            # add a line break between movies
+            f.write("\n")
+    os.replace(fileName + ".tmp",fileName)
 
 # Find number of movies and users
 nMovies = len(movieIds)
-nUsers = len(userIds)
+nUsers = len(np.unique(store.users))
 
 # Print required outputs
 print("Input MovieLens file: " + dataFile)
-print("Output file for similarity data: " + outputFile)
+if metricNames is None:
+    print("Output file for similarity data: " + outputFile)
+else:
+    for name in metricNames:
+        print("Output file for {} similarity data: {}"
+              .format(name,metric_file(outputFile,name)))
 print("Minimum number of common users: {}".format(userThresh))
 countStatement = "Read {} lines with total of {} movies and {} users"
 print(countStatement.format(lines,nMovies,nUsers))
 print("Computed similarities in {} seconds".format(t5-t1))
+if updating:
+    print("Updated {} lines of the output file".format(changedLines))
+# For the lsh engine, compare the results for a sample of movies with the
+# exact results. This is not included in the time above.
+if options['engine'] == 'lsh':
+    print("LSH candidate pairs: {}".format(nCandidates))
+    if int(options['recall-sample']) > 0:
+        (recall,nSample) = minhash.recall(store,topMatches,userThresh,topK,
+                                          int(options['recall-sample']),
+                                          int(options['seed']))
+        if recall is None:
+            print("LSH recall: no valid pairs in a sample of {} movies"
+                  .format(nSample))
+        else:
+            print("LSH recall of the top {} on {} sampled movies: {}"
+                  .format(topK,nSample,recall))
@@ -0,0 +1,388 @@
+# This program answers "movies similar to X" queries from precomputed
+# similarity results, over HTTP.
+#
+# The results are first built into an index directory, either from a state
+# saved by similarity.py with --state (see incremental.py) or from an output
+# file of similarity.py. The index holds, for each movie in order of movie
+# id, its most similar movies with their similarity coefficients and numbers
+# of shared users, as .npy arrays that the server memory-maps, so a query is
+# a binary search and a slice of the arrays.
+#
+# Recent answers are kept in a least-recently-used cache. When the server is
+# given a state, movies that are not in the index (for example, ones added to
+# the state since the index was built) and queries for more movies than the
+# index holds are answered by computing the similarities of the movie on
+# demand. The time taken by each query is recorded, and percentiles of the
+# recent times are reported by the /stats endpoint.
+#
+# Endpoints:
+#   GET /neighbors?movie=<id>[&k=<K>]  most similar movies to a movie
+#   GET /stats                         query latency percentiles and counts
+
+# Import modules
+import collections
+import http.server
+import json
+import os
+import re
+import sys
+import threading
+import time
+import urllib.parse
+
+import numpy as np
+
+import incremental
+import sparsesim
+
+# Version of the index format, stored in the index so that indexes written in
+# an older format are not used
+INDEX_VERSION = 1
+# Names of the arrays stored in the index
+INDEX_FIELDS = ['movieIds','offsets','neighbors','sims','shared']
+# Number of recent query times used for the latency percentiles
+LATENCY_WINDOW = 10000
+
+# Function to write an index directory from a dictionary whose keys are
+# movie ids and whose values are lists of (movie, similarity coefficient,
+# number of shared users) tuples, most similar first. movieIds lists every
+# movie, including those without any similar movies. Up to topK similar
+# movies are kept for each movie; the index records the largest number kept,
+# which is less than topK if no movie had that many.
+def write_index(indexDir,movieIds,matches,topK):
+    movieIds = np.array(sorted(movieIds),dtype=np.int64)
+    offsets = np.zeros(len(movieIds) + 1,dtype=np.int64)
+    neighbors = []
+    sims = []
+    shared = []
+    for (i,movie) in enumerate(movieIds.tolist()):
+        for (movie2,sim,nShared) in matches.get(movie,[])[:topK]:
+            neighbors.append(movie2)
+            sims.append(sim)
+            shared.append(nShared)
+        offsets[i+1] = len(neighbors)
+    arrays = {'movieIds': movieIds, 'offsets': offsets,
+              'neighbors': np.array(neighbors,dtype=np.int64),
+              'sims': np.array(sims,dtype=np.float64),
+              'shared': np.array(shared,dtype=np.int64)}
+    os.makedirs(indexDir,exist_ok=True)
+    metaFile = os.path.join(indexDir,"meta.json")
+    if os.path.exists(metaFile):
+        os.remove(metaFile)
+    for name in INDEX_FIELDS:
+        np.save(os.path.join(indexDir,name + ".npy"),arrays[name])
+    with open(metaFile + ".tmp",'w') as f:
+        keptK = int(np.diff(offsets).max()) if len(movieIds) > 0 else 0
+        json.dump({'version': INDEX_VERSION, 'topK': min(topK,keptK)},f)
+    os.replace(metaFile + ".tmp",metaFile)
+
+# Function to read the most similar movies from an output file of
+# similarity.py, in the same form as the dictionary used by write_index.
+# Returns the list of movie ids and the dictionary.
+def read_output(fileName):
+    pattern = re.compile(r"\((-?\d+),([^,]+),(\d+)\)")
+    movieIds = []
+    matches = dict()
+    with open(fileName,'r') as f:
+        for line in f:
+            fields = line.split(None,1)
+            if len(fields) == 0:
+                continue
+            movie = int(fields[0])
+            movieIds.append(movie)
+            if len(fields) > 1:
+                matches[movie] = [(int(m),float(s),int(n)) for (m,s,n)
+                                  in pattern.findall(fields[1])]
+    return (movieIds,matches)
+
+# Function to build an index from a state directory or an output file of
+# similarity.py, keeping up to topK similar movies for each movie
+def build_index(source,indexDir,topK):
+    if os.path.isdir(source):
+        state = incremental.SimilarityState.load(source)
+        movieIds = state.store.movieIds.tolist()
+        matches = state.top_matches(topK=topK)
+    else:
+        (movieIds,matches) = read_output(source)
+    write_index(indexDir,movieIds,matches,topK)
+    return len(movieIds)
+
+# Class for the index of precomputed similar movies, memory-mapped from an
+# index directory.
+#
+# Attributes:
+#   topK: largest number of similar movies stored for any movie; queries
+#         for more are computed when there is a state
+#   arrays: dictionary of the memory-mapped arrays named in INDEX_FIELDS
+#
+# Methods:
+#   lookup(movie,k): return up to k similar movies, or None if the movie is
+#                    not in the index
+class NeighborIndex:
+    def __init__(self,indexDir):
+        try:
+            with open(os.path.join(indexDir,"meta.json"),'r') as f:
+                meta = json.load(f)
+        except (OSError,ValueError):
+            raise RuntimeError("No similarity index in " + indexDir)
+        if meta.get('version') != INDEX_VERSION:
+            raise RuntimeError("Similarity index in {} has an unknown version"
+                               .format(indexDir))
+        self.topK = meta['topK']
+        self.arrays = dict()
+        for name in INDEX_FIELDS:
+            self.arrays[name] = np.load(os.path.join(indexDir,name + ".npy"),
+                                        mmap_mode='r')
+
+    def __len__(self):
+        return len(self.arrays['movieIds'])
+
+    # Function to find up to k similar movies for a movie.
+    # Returns a list of (movie, similarity coefficient, number of shared
+    # users) tuples, most similar first, or None if the movie is not in the
+    # index.
+    def lookup(self,movie,k):
+        movieIds = self.arrays['movieIds']
+        i = int(np.searchsorted(movieIds,movie))
+        if i == len(movieIds) or movieIds[i] != movie:
+            return None
+        start = int(self.arrays['offsets'][i])
+        stop = min(int(self.arrays['offsets'][i+1]),start + k)
+        return list(zip(self.arrays['neighbors'][start:stop].tolist(),
+                        self.arrays['sims'][start:stop].tolist(),
+                        self.arrays['shared'][start:stop].tolist()))
+
+# Class for a least-recently-used cache of query answers, which can be used
+# from several threads.
+# A maximum size of 0 turns the cache off.
+class NeighborCache:
+    def __init__(self,maxSize):
+        self.maxSize = maxSize
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    # Function to get a cached answer, or None if there is none
+    def get(self,key):
+        with self.lock:
+            if key not in self.entries:
+                return None
+            self.entries.move_to_end(key)
+            return self.entries[key]
+
+    # Function to add an answer, removing the least recently used one if the
+    # cache is full
+    def put(self,key,value):
+        if self.maxSize == 0:
+            return
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            if len(self.entries) > self.maxSize:
+                self.entries.popitem(last=False)
+
+# Class answering queries for similar movies from an index, a cache, and
+# (if a state is given) on-demand computation.
+#
+# Attributes:
+#   index: the NeighborIndex
+#   state: the incremental.SimilarityState used for on-demand computation,
+#          or None
+#   cache: the NeighborCache of recent answers
+#   latencies: recent query times in seconds
+#   counts: number of queries answered from each source
+#
+# Methods:
+#   query(movie,k): return the similar movies and where they came from
+#   compute(movie,k): find the similar movies from the state
+#   stats(): return the latency percentiles and counts
+class QueryService:
+    def __init__(self,index,state=None,cacheSize=1024):
+        self.index = index
+        self.state = state
+        self.cache = NeighborCache(cacheSize)
+        self.latencies = collections.deque(maxlen=LATENCY_WINDOW)
+        self.counts = {'index': 0, 'cache': 0, 'computed': 0, 'missing': 0}
+        self.lock = threading.Lock()
+        self.userIdx = None
+        self.positions = None
+
+    # Function to find up to k similar movies for a movie.
+    # Returns a tuple of the list of (movie, similarity coefficient, number
+    # of shared users) tuples, or None if the movie is unknown, and the
+    # source of the answer: 'cache', 'index', 'computed', or 'missing'.
+    def query(self,movie,k):
+        start = time.perf_counter()
+        key = (movie,k)
+        matches = self.cache.get(key)
+        source = 'cache'
+        if matches is None:
+            if k <= self.index.topK:
+                matches = self.index.lookup(movie,k)
+                source = 'index'
+            if matches is None and self.state is not None:
+                matches = self.compute(movie,k)
+                source = 'computed'
+            if matches is None and k > self.index.topK:
+                # Without a state, give as many as the index has
+                matches = self.index.lookup(movie,k)
+                source = 'index'
+            if matches is None:
+                source = 'missing'
+            else:
+                self.cache.put(key,matches)
+        elapsed = time.perf_counter() - start
+        with self.lock:
+            self.latencies.append(elapsed)
+            self.counts[source] += 1
+        return (matches,source)
+
+    # Function to find up to k similar movies for a movie from the state, by
+    # finding the sums of the movie's pairs with every other movie.
+    # Returns None if the movie is not in the state.
+    def compute(self,movie,k):
+        state = self.state
+        with self.lock:
+            if self.userIdx is None:
+                self.userIdx = state.store.user_index()
+                self.positions = dict((m,i) for (i,m) in
+                                      enumerate(state.store.movieIds.tolist()))
+        if movie not in self.positions:
+            return None
+        position = self.positions[movie]
+        inSet = np.zeros(len(state.store),dtype=bool)
+        inSet[position] = True
+        pairs = incremental.pair_sums(state.store,self.userIdx,inSet,
+                                      state.userThresh)
+        (sim,valid) = incremental.pair_similarities(pairs,
+                                                    state.sums / state.counts)
+        others = np.where(pairs['first'] == position,pairs['second'],
+                          pairs['first'])
+        rows = np.full(int(valid.sum()),position)
+        matches = sparsesim.merge_candidates(
+            state.store.movieIds.tolist(),
+            [(rows,others[valid],sim[valid],pairs['n'][valid])],k)
+        return matches.get(movie,[])
+
+    # Function to get the percentiles of the recent query times (in
+    # milliseconds) and the number of queries answered from each source
+    def stats(self):
+        with self.lock:
+            latencies = np.array(self.latencies) * 1000.0
+            counts = dict(self.counts)
+        result = {'queries': counts, 'window': len(latencies)}
+        if len(latencies) > 0:
+            for p in [50,90,99]:
+                result['p{}_ms'.format(p)] = float(np.percentile(latencies,p))
+            result['max_ms'] = float(latencies.max())
+        return result
+
+# Class handling the HTTP requests of the server. The QueryService is set as
+# a class attribute before the server starts.
+class QueryHandler(http.server.BaseHTTPRequestHandler):
+    service = None
+    defaultK = 10
+
+    # Function to send a JSON response
+    def send_json(self,status,body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type","application/json")
+        self.send_header("Content-Length",str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        url = urllib.parse.urlparse(self.path)
+        params = urllib.parse.parse_qs(url.query)
+        if url.path == "/stats":
+            self.send_json(200,self.service.stats())
+            return
+        if url.path != "/neighbors":
+            self.send_json(404,{'error': "unknown path " + url.path})
+            return
+        try:
+            movie = int(params['movie'][0])
+            k = int(params.get('k',[self.defaultK])[0])
+            if k < 1:
+                raise ValueError
+        except (KeyError,ValueError):
+            self.send_json(400,{'error': "expected movie=<id> and k=<K>"})
+            return
+        (matches,source) = self.service.query(movie,k)
+        if matches is None:
+            self.send_json(404,{'error': "unknown movie {}".format(movie)})
+            return
+        neighbors = [{'movie': m, 'similarity': s, 'shared': n}
+                     for (m,s,n) in matches]
+        self.send_json(200,{'movie': movie, 'k': k, 'source': source,
+                            'neighbors': neighbors})
+
+    # Requests are not logged, as printing each one would take longer than
+    # answering it
+    def log_message(self,format,*args):
+        pass
+
+# Function to parse options given as pairs of a name and a value, updating
+# the dictionary of defaults. Exits with an error for unknown options.
+def parse_options(optionArgs,options):
+    if len(optionArgs) % 2 != 0:
+        print("ERROR: option {} has no value".format(optionArgs[-1]))
+        sys.exit(2)
+    for i in range(0,len(optionArgs),2):
+        name = optionArgs[i][2:]
+        if not optionArgs[i].startswith("--") or name not in options:
+            print("ERROR: unknown option {}".format(optionArgs[i]))
+            sys.exit(2)
+        options[name] = optionArgs[i+1]
+    return options
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3 or sys.argv[1] not in ('build','serve'):
+        print("Usage:")
+        print("  $ python3 simserver.py build <state_dir|similarity_file> <index_dir> [--topk <K>]")
+        print("  $ python3 simserver.py serve <index_dir> [options]")
+        print("Build options:")
+        print("  --topk <K>            similar movies stored for each movie (default = 20)")
+        print("Serve options:")
+        print("  --state <dir>         state saved by similarity.py --state, used to compute")
+        print("                        answers that are not in the index")
+        print("  --host <host>         address to listen on (default = 127.0.0.1)")
+        print("  --port <port>         port to listen on (default = 8080)")
+        print("  --cache-size <n>      number of answers kept in the cache (default = 1024)")
+        print("  --k <K>               number of similar movies returned when a query")
+        print("                        does not give k (default = 10)")
+        sys.exit(0)
+    try:
+        if sys.argv[1] == 'build':
+            if len(sys.argv) < 4:
+                print("ERROR: build needs a source and an index directory")
+                sys.exit(2)
+            options = parse_options(sys.argv[4:],{'topk': '20'})
+            nMovies = build_index(sys.argv[2],sys.argv[3],int(options['topk']))
+            print("Indexed {} movies in {}".format(nMovies,sys.argv[3]))
+            sys.exit(0)
+        options = parse_options(sys.argv[3:],{'state': None,
+                                              'host': '127.0.0.1',
+                                              'port': '8080',
+                                              'cache-size': '1024',
+                                              'k': '10'})
+        index = NeighborIndex(sys.argv[2])
+        state = None
+        if options['state'] is not None:
+            state = incremental.SimilarityState.load(options['state'])
+    except RuntimeError as e:
+        print("ERROR: {}".format(e))
+        sys.exit(2)
+    QueryHandler.service = QueryService(index,state,int(options['cache-size']))
+    QueryHandler.defaultK = int(options['k'])
+    server = http.server.ThreadingHTTPServer((options['host'],
+                                              int(options['port'])),
+                                             QueryHandler)
+    print("Serving {} movies on http://{}:{}".format(len(index),
+                                                     options['host'],
+                                                     options['port']))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
@@ -0,0 +1,222 @@
+# This module computes the similarity coefficients of all movie pairs using
+# sparse matrix products instead of comparing each pair of movies in Python.
+# The mean-centered ratings are stored as a sparse user x movie matrix C,
+# along with an indicator matrix B that is 1 wherever a user rated a movie.
+# For movies i and j, summing over the users who rated both:
+#   (C^T C)[i,j]     = sum of products of the centered ratings (numerator)
+#   (C2^T B)[i,j]    = sum of squares of movie i's centered ratings
+#   (B^T C2)[i,j]    = sum of squares of movie j's centered ratings
+#   (B^T B)[i,j]     = number of shared users
+# where C2 holds the squares of the entries of C. The products are formed a
+# tile of movies (rows) x movies (columns) at a time, and the user threshold
+# and zero denominator rules are applied to the whole tile at once.
+#
+# The results are symmetric, so only the tiles on or above the diagonal are
+# computed, and each tile gives candidates for the movies of its rows and of
+# its columns. The tiles can be shared out between worker processes. The
+# matrices are then placed in shared memory, which the workers attach to
+# when they start, so only the tile ranges and the candidates are sent
+# between processes. The candidates from all tiles are merged at the end.
+# The tiles are the same whatever the number of workers, and ties are broken
+# by the position of the movies in the store, so the results do not depend
+# on the number of workers.
+
+# Import modules
+import multiprocessing
+import multiprocessing.shared_memory
+
+import numpy as np
+import scipy.sparse
+
+# Number of movies along each side of a tile. Each tile uses several dense
+# arrays of TILE_MOVIES x TILE_MOVIES entries.
+TILE_MOVIES = 1024
+
+# Matrices used by the worker processes, set by attach_shared
+sharedMatrices = None
+
+# Function to convert the store of centered ratings (see ratings.py) into
+# sparse matrices.
+# Returns the list of movie ids (in the store's order, which gives the
+# column of each movie) and the user x movie matrices C, C2, and B in
+# compressed sparse column format.
+def centered_matrices(store):
+    movieIds = store.movieIds.tolist()
+    # The rows of the matrices are the users, in order of user id
+    (userIds,rows) = np.unique(store.users,return_inverse=True)
+    shape = (len(userIds),len(movieIds))
+    rows = rows.ravel()
+    offsets = store.offsets
+    values = store.values
+    C = scipy.sparse.csc_matrix((values,rows,offsets),shape=shape)
+    C2 = scipy.sparse.csc_matrix((values ** 2,rows,offsets),shape=shape)
+    B = scipy.sparse.csc_matrix((np.ones(len(values)),rows,offsets),
+                                shape=shape)
+    return (movieIds,C,C2,B)
+
+# Function to compute the similarities between a block of movies (rows) and
+# another block of movies (columns), given as ranges of column indices.
+# Returns dense arrays of the similarity coefficients and numbers of shared
+# users, and a boolean array marking the pairs with a valid coefficient.
+def similarity_block(C,C2,B,rowStart,rowStop,colStart,colStop):
+    CT = C[:,rowStart:rowStop].T.tocsr()
+    C2T = C2[:,rowStart:rowStop].T.tocsr()
+    BT = B[:,rowStart:rowStop].T.tocsr()
+    Ccols = C[:,colStart:colStop]
+    C2cols = C2[:,colStart:colStop]
+    Bcols = B[:,colStart:colStop]
+    nShared = (BT @ Bcols).toarray()
+    s12 = (CT @ Ccols).toarray()
+    s1 = (C2T @ Bcols).toarray()
+    s2 = (BT @ C2cols).toarray()
+    denominator = s1 * s2
+    valid = denominator != 0
+    # A movie is not compared with itself
+    for row in range(max(rowStart,colStart),min(rowStop,colStop)):
+        valid[row-rowStart,row-colStart] = False
+    sim = np.zeros(valid.shape)
+    sim[valid] = s12[valid] / np.sqrt(denominator[valid])
+    return (sim,nShared,valid)
+
+# Function to find the columns of the topK largest values in each row of a
+# block of similarities, largest first. Ties go to the column that comes
+# first, as with argmax.
+def top_columns(sim,topK):
+    if topK == 1:
+        return np.argmax(sim,axis=1)[:,None]
+    # A stable sort keeps tied values in column order
+    return np.argsort(-sim,axis=1,kind='stable')[:,:topK]
+
+# Function to find the topK candidates for each row of a block of
+# similarities. Returns arrays of the row, column, similarity coefficient,
+# and number of shared users of each candidate, with rowOffset and colOffset
+# added to the rows and columns.
+def block_candidates(sim,nShared,valid,topK,rowOffset,colOffset):
+    cols = top_columns(sim,topK)
+    rows = np.repeat(np.arange(sim.shape[0]),cols.shape[1])
+    cols = cols.ravel()
+    keep = valid[rows,cols]
+    rows = rows[keep]
+    cols = cols[keep]
+    return (rows + rowOffset,cols + colOffset,sim[rows,cols],
+            nShared[rows,cols])
+
+# Function to compute one tile of similarities, given as ranges of movie
+# (column) indices, and return its candidates (see block_candidates) for the
+# movies of both its rows and its columns.
+def tile_candidates(C,C2,B,userThresh,topK,tile):
+    (rowStart,rowStop,colStart,colStop) = tile
+    (sim,nShared,valid) = similarity_block(C,C2,B,rowStart,rowStop,
+                                           colStart,colStop)
+    valid &= nShared >= userThresh
+    sim[~valid] = -np.inf
+    found = [block_candidates(sim,nShared,valid,topK,rowStart,colStart)]
+    # A tile on the diagonal already covers both orders of each pair
+    if rowStart != colStart:
+        found.append(block_candidates(sim.T,nShared.T,valid.T,topK,
+                                      colStart,rowStart))
+    return tuple(np.concatenate(arrays) for arrays in zip(*found))
+
+# Function to list the tiles on or above the diagonal of the matrix of
+# similarities between nMovies movies
+def upper_tiles(nMovies):
+    tiles = []
+    for rowStart in range(0,nMovies,TILE_MOVIES):
+        rowStop = min(rowStart + TILE_MOVIES,nMovies)
+        for colStart in range(rowStart,nMovies,TILE_MOVIES):
+            colStop = min(colStart + TILE_MOVIES,nMovies)
+            tiles.append((rowStart,rowStop,colStart,colStop))
+    return tiles
+
+# Function to copy the arrays of the sparse matrices into shared memory.
+# Returns the shared memory blocks, which must be closed and unlinked by the
+# caller, and a description of each array (name, block name, dtype, and
+# shape) for attach_shared.
+def share_matrices(C,C2,B):
+    arrays = {'indptr': C.indptr, 'indices': C.indices, 'C': C.data,
+              'C2': C2.data, 'B': B.data}
+    blocks = []
+    specs = []
+    for (name,array) in arrays.items():
+        block = multiprocessing.shared_memory.SharedMemory(
+            create=True,size=max(array.nbytes,1))
+        blocks.append(block)
+        np.ndarray(array.shape,dtype=array.dtype,buffer=block.buf)[:] = array
+        specs.append((name,block.name,array.dtype.str,array.shape))
+    return (blocks,specs)
+
+# Function run when each worker process starts, to rebuild the sparse
+# matrices from the arrays in shared memory without copying them.
+# The shared memory blocks are kept in the global variable so that they stay
+# open for as long as the worker runs.
+def attach_shared(specs,shape,userThresh,topK):
+    global sharedMatrices
+    blocks = []
+    arrays = dict()
+    for (name,blockName,dtype,arrayShape) in specs:
+        block = multiprocessing.shared_memory.SharedMemory(name=blockName)
+        blocks.append(block)
+        arrays[name] = np.ndarray(arrayShape,dtype=dtype,buffer=block.buf)
+    matrices = []
+    for name in ['C','C2','B']:
+        matrices.append(scipy.sparse.csc_matrix(
+            (arrays[name],arrays['indices'],arrays['indptr']),shape=shape,
+            copy=False))
+    sharedMatrices = (matrices,userThresh,topK,blocks)
+
+# Function run by the worker processes to compute the candidates of a tile
+def shared_tile_candidates(tile):
+    ((C,C2,B),userThresh,topK,blocks) = sharedMatrices
+    return tile_candidates(C,C2,B,userThresh,topK,tile)
+
+# Function to keep the topK candidates of each movie, largest similarity
+# coefficient first, with ties going to the movie that comes first in the
+# store. Returns the kept candidates as a dictionary in the form
+# described in top_matches.
+def merge_candidates(movieIds,candidates,topK):
+    (rows,cols,sims,nShared) = (np.concatenate(arrays)
+                                for arrays in zip(*candidates))
+    order = np.lexsort((cols,-sims,rows))
+    (rows,cols,sims,nShared) = (rows[order],cols[order],sims[order],
+                                nShared[order])
+    # Position of each candidate among the candidates of its movie
+    first = np.searchsorted(rows,rows)
+    keep = np.arange(len(rows)) - first < topK
+    matches = dict()
+    for (row,col,sim,n) in zip(rows[keep],cols[keep],sims[keep],
+                               nShared[keep]):
+        movie = movieIds[row]
+        if movie not in matches:
+            matches[movie] = []
+        matches[movie].append((movieIds[col],float(sim),int(n)))
+    return matches
+
+# Function to find the topK most similar movies to each movie, using a pool
+# of worker processes if workers is more than 1.
+# Returns a dictionary whose keys are movie ids and whose values are lists of
+# tuples of a similar movie, the similarity coefficient, and the number of
+# shared users, most similar first. Movies without any valid pair are left
+# out, and movies with fewer than topK valid pairs have shorter lists.
+# When several movies have the same coefficient, the one that comes first in
+# the store is listed first, as the dict engine of similarity.py does.
+def top_matches(store,userThresh,topK=1,workers=1):
+    (movieIds,C,C2,B) = centered_matrices(store)
+    tiles = upper_tiles(len(movieIds))
+    candidates = [(np.zeros(0,dtype=np.int64),np.zeros(0,dtype=np.int64),
+                   np.zeros(0),np.zeros(0))]
+    if workers == 1:
+        for tile in tiles:
+            candidates.append(tile_candidates(C,C2,B,userThresh,topK,tile))
+    else:
+        (blocks,specs) = share_matrices(C,C2,B)
+        try:
+            context = multiprocessing.get_context('fork')
+            initargs = (specs,C.shape,userThresh,topK)
+            with context.Pool(workers,attach_shared,initargs) as pool:
+                for found in pool.imap_unordered(shared_tile_candidates,tiles):
+                    candidates.append(found)
+        finally:
+            for block in blocks:
+                block.close()
+                block.unlink()
+    return merge_candidates(movieIds,candidates,topK)
@@ -4,10 +4,127 @@ object.
 """
 
 # Import useful modules
+import concurrent.futures
 import glob
+import io
+import json
 import math
 import os
 
+import numpy as np
+import scipy.interpolate
+
+# Name of the cache file written in each airfoil directory
+CACHE_NAME = "cp_cache.npz"
+# Version of the cache format, stored in the cache so that caches written in
+# an older format are not used
+CACHE_VERSION = 2
+# Number of threads used to read the cp files
+READ_THREADS = 8
+# Relative size below which a lift coefficient is rounding error
+ROUNDING = 1e-12
+# Kinds of interpolation between attack angles
+INTERP_KINDS = ['linear','pchip']
+
+# Define a class for interpolated results
+class AirfoilInterpolant:
+    """
+    AirfoilInterpolant: a class used to find the results of an airfoil at
+    any attack angle.
+
+    This class takes in the sorted attack angles of an airfoil, and the
+    lift coefficient and stagnation point at each angle, and interpolates
+    between them. The interpolation is either linear, or monotone cubic
+    (PCHIP), which is smooth but never goes above or below the values at
+    the angles on either side. Angles may be given as numbers or as NumPy
+    arrays, and outside the range of the angles the results are NaN.
+
+    Attributes:
+    -----------
+    kind : str
+        the kind of interpolation, 'linear' or 'pchip'
+    angles : ndarray
+        the angles of the data, sorted
+    cl : ndarray
+        the lift coefficient at each angle
+    stagx : ndarray
+        the x-coordinate of the stagnation point at each angle
+    stagy : ndarray
+        the y-coordinate of the stagnation point at each angle
+    splines : tuple
+        the monotone cubic interpolants of cl, stagx, and stagy, or None
+        for linear interpolation
+
+    Methods:
+    --------
+    interpolate(alpha,i)
+        returns the interpolated values of one of the quantities
+    lift_coeff(alpha)
+        returns the interpolated lift coefficient
+    stagnation(alpha)
+        returns the interpolated x and y coordinates of the stagnation
+        point
+    __call__(alpha)
+        returns the interpolated lift coefficient
+    """
+
+    def __init__(self,angles,cl,stags,kind='linear'):
+        """
+        Constructs the interpolant from the sorted angles, the lift
+        coefficient at each angle, and the stagnation point at each angle
+        (one row per angle, starting with the x and y coordinates).
+        """
+        if kind not in INTERP_KINDS:
+            raise RuntimeError('Unknown interpolation: {}'.format(kind))
+        if len(angles) < 2:
+            raise RuntimeError('Interpolation needs at least two angles')
+        self.__kind = kind
+        self.__angles = np.array(angles,dtype=np.float64)
+        self.__cl = np.array(cl,dtype=np.float64)
+        self.__stagx = np.array(stags[:,0],dtype=np.float64)
+        self.__stagy = np.array(stags[:,1],dtype=np.float64)
+        # The cubic pieces between each pair of angles are found once here,
+        # so each query only has to evaluate them.
+        self.__splines = None
+        if kind == 'pchip':
+            self.__splines = tuple(
+                scipy.interpolate.PchipInterpolator(self.__angles,values,
+                                                    extrapolate=False)
+                for values in (self.__cl,self.__stagx,self.__stagy))
+
+    def interpolate(self,alpha,i):
+        """
+        Interpolates one of the quantities (0 for cl, 1 for the x-coordinate
+        of the stagnation point, and 2 for its y-coordinate) at the given
+        angles. This returns a number if alpha is a number, and an array of
+        the same shape as alpha otherwise.
+        """
+        if self.__splines is not None:
+            return self.__splines[i](alpha)[()]
+        values = (self.__cl,self.__stagx,self.__stagy)[i]
+        return np.interp(alpha,self.__angles,values,left=np.nan,
+                         right=np.nan)
+
+    def lift_coeff(self,alpha):
+        """
+        Finds the lift coefficient at the given angles.
+        """
+        return self.interpolate(alpha,0)
+
+    def stagnation(self,alpha):
+        """
+        Finds the stagnation point at the given angles, and returns a tuple
+        of the x and y coordinates.
+        """
+        return (self.interpolate(alpha,1),self.interpolate(alpha,2))
+
+    def __call__(self,alpha):
+        """
+        Finds the lift coefficient at the given angles, so that the
+        interpolant can be used as a function of alpha.
+        """
+        return self.interpolate(alpha,0)
+
 # Define an Airfoil class
 class Airfoil:
     """
@@ -18,6 +135,11 @@ class Airfoil:
     angles. It processes this data and uses it to determine the lift
     coefficient and stagnation point at each attack angle.
 
+    In lazy mode, the cp data at an angle is only read, and its results
+    calculated, when that angle is first asked for. The directory can be
+    scanned again with refresh(), which only reads the files that were
+    added or changed since the last scan.
+
     Attributes:
     -----------
     inputdir : str
@@ -26,52 +148,105 @@ class Airfoil:
         the path name to find the xy data
     nacaId : str
         the name of the particular airfoil type
-    x : list
+    x : ndarray
         the x-coordinates, in order
-    y : list
+    y : ndarray
         the y-coordinates, in order
     lenData : int
-        the number of line segments representing the airfoil
+        the number of line segments (panels) representing the airfoil
     cpPaths : list
         the path names to find the cp data files
-    cpAlpha : dict
-        the cp data, broken up by angles. Each value is a list.
-    angles : list
-        the angles of the provided data, sorted
+    cachePath : str
+        the path name of the cache file, or None if no cache is used
+    threads : int
+        the number of threads used to read the cp files
+    lazy : bool
+        whether cp files are only read when their angle is asked for
+    stamps : dict
+        the size and modification time of each data file at the last scan.
+        Keys are file names.
+    pending : dict
+        the angle of each cp file that has not been read yet (None if the
+        file name is improper). Keys are path names.
+    problems : dict
+        the kind of error found in each flawed cp file that has been read,
+        and its details. Keys are path names.
+    angles : ndarray
+        the angles of the valid data read so far, sorted
+    cp : ndarray
+        the cp data, with one row per angle (in the order of angles) and
+        one column per panel
     chord : float
         the chord length
-    cl : dict
-        the lift coefficient at each angle. Values are floats.
-    stags : dict
-        the stagnation point at each angle. Values are tuples.
+    cl : ndarray
+        the lift coefficient at each angle, in the order of angles
+    stags : ndarray
+        the stagnation point at each angle, in the order of angles. Each
+        row holds the x and y coordinates and the cp value.
 
     Methods:
     --------
     read_xy()
         returns two lists containing the x and y data
-    read_cp(alpha)
-        returns a list containing the cp data at each angle
+    read_cp(pathName)
+        returns an array containing the cp data in a file
         also returns a list of line numbers containing errors
-    dcx(alpha,i)
-        returns the x-component of the non-dimensional pressure force
-    dcy(alpha,i)
-        returns the y-component of the non-dimensional pressure force
+    cp_angle(pathName)
+        returns the angle given by the name of a cp file
+    cp_message(pathName,kind,info)
+        returns the error message for a flawed cp file
+    read_all_cp(pathNames)
+        returns a dictionary of the valid cp data at each angle and a
+        dictionary of the errors found
+    file_stamps(cpPaths)
+        returns the size and modification time of each data file
+    read_cache(stamps)
+        returns the data stored in the cache, if it matches the files
+    write_cache()
+        stores the data in the cache
+    set_geometry(nacaId,x,y)
+        stores the shape of the airfoil, and clears all cp data
+    add_angles(angles,cp)
+        stores the cp data at some angles and calculates their results
+    load(alpha)
+        reads the cp files that have not been read yet at an angle, or at
+        all angles
+    refresh()
+        scans the directory again and reads any added or changed files
+    dcx()
+        returns the x-component of the non-dimensional pressure force on
+        each panel at each angle
+    dcy()
+        returns the y-component of the non-dimensional pressure force on
+        each panel at each angle
     lift_coeff(alpha)
         returns the lift coefficient at a given angle
-    calc_cls()
-        returns a dictionary of the lift coefficient at each angle
+    calc_cls(angles,cp)
+        returns an array of the lift coefficient at each angle
     stagnation(alpha)
         returns a tuple giving the stagnation point at a given angle
-    calc_stags(alpha)
-        returns a dictionary of the stagnation point at each angle
+    calc_stags(cp)
+        returns an array of the stagnation point at each angle
+    results()
+        returns the NACA id and arrays of the angles, lift coefficients,
+        and stagnation points
+    interpolant(kind)
+        returns an AirfoilInterpolant of the results
     __repr__
         converts the Airfoil's information into a formatted string
     """
     
-    def __init__(self,inputdir):
+    def __init__(self,inputdir,threads=READ_THREADS,cache=True,lazy=False):
         """
         Constructs an airfoil object, reads given files, and calculates all
         required results.
+
+        The cp files are read by a pool of the given number of threads. If
+        cache is True, the data is stored in a cache file in the directory
+        after it has been read, and later objects use the cache instead of
+        reading the text files for as long as the files are unchanged. If
+        lazy is True, only the xy data is read here, and each cp file is
+        read when its angle is first asked for.
         """
         # Make sure that the directory has a '/' at the end to allow for access
         # of files inside the directory.
@@ -84,70 +259,35 @@ class Airfoil:
         if not os.path.exists(self.__inputdir):
             raise RuntimeError('Given directory does not exist.')
 
-        # Identify and read the xy data.
+        # Identify the xy data.
         self.__xyPath = self.__inputdir + "xy.dat"
         if not os.path.exists(self.__xyPath):
             raise RuntimeError('No xy data')
-        (self.__nacaId,self.__x,self.__y) = self.read_xy()
-        self.__lenData = len(self.__x) - 1
-        
-        # Identify all files that have pressure coefficient data at a certain
-        # attack angle.
-        self.__cpPaths = glob.glob(self.__inputdir+"alpha*.dat")
+
+        self.__threads = threads
+        self.__lazy = lazy
+        self.__cachePath = None
+        if cache:
+            self.__cachePath = self.__inputdir + CACHE_NAME
+        # Nothing has been scanned yet, so the first scan reads the xy data,
+        # and all the cp data unless the object is lazy.
+        self.__cpPaths = []
+        self.__stamps = dict()
+        self.__pending = dict()
+        self.__problems = dict()
+        self.refresh()
         if len(self.__cpPaths) == 0:
             raise RuntimeError('No cp data')
-        # For each file, identify the angle, and read the file. The data is
-        # stored in a dictionary using the attack angles (converted to numbers)
-        # as keys and a lists with the data as values. If any error is
-        # identified, an appropriate message is printed, and the file in
-        # question is skipped, allowing the program to continue with the valid
-        # data.
-        self.__cpAlpha = dict()
-        for pathName in self.__cpPaths:
-            fileName = os.path.split(pathName)[1]
-            alphaStr = fileName[5:-4]
-            try:
-                alpha = float(alphaStr)
-                (cp,errors) = self.read_cp(pathName)
-                if len(errors) > 0:
-                    string = "ERROR: Non-numerical cp data at alpha = {}: {}"
-                    print(string.format(alpha,errors))
-                    continue
-                if len(cp) == self.__lenData:
-                    self.__cpAlpha[alpha] = cp
-                elif len(cp) == 0:
-                    print("ERROR: {} has no data".format(alpha))
-                elif len(cp) > self.__lenData:
-                    print("ERROR: {} has too many values".format(pathName))
-                elif len(cp) < self.__lenData:
-                    print("ERROR: {} has too few values".format(pathName))
-            except ValueError:
-                print("ERROR: {} has improper name".format(pathName))
-        # Make a sorted list of the angles.  If no valid data was
-        # identified, raise an error.
-        self.__angles = sorted(self.__cpAlpha.keys())
-        if len(self.__angles) == 0:
+        # If no valid data was identified, raise an error.
+        if not lazy and len(self.__angles) == 0:
             raise RuntimeError("All cp data is flawed")
 
-        # Calculate the chord length (the distance from the point with the
-        # lowest x value to the point with the highest x value).
-        leadx = min(self.__x)
-        leady = self.__y[self.__x.index(leadx)]
-        trailx = max(self.__x)
-        traily = self.__y[self.__x.index(trailx)]
-        self.__chord = math.sqrt((leadx-trailx)**2 + (leady-traily)**2)
-
-        # Calculate the lift coefficents and stagnation points
-        self.__cl = self.calc_cls()
-        self.__stags = self.calc_stags()
-
-
     def read_xy(self):
         """
         Reads the file containing data on the shape of the airfoil.
         
         This converts the file to numerical data, and returns a string
-        naming the airfoil type, a list with the x data, and a list with
+        naming the airfoil type, an array with the x data, and an array with
         the y data.
         """
         x = []
@@ -174,119 +314,472 @@ class Airfoil:
             raise RuntimeError("Non-numerical points: {}".format(tErrors))
         if len(cErrors) > 0:
             raise RuntimeError("Points missing y-value: {}".format(cErrors))
-        return (nacaId,x,y)
+        return (nacaId,np.array(x),np.array(y))
 
     def read_cp(self,pathName):
         """
         Reads the cp data from a given file.
 
-        This returns a list of cp data and a list of the indices of lines
-        containing flawed data.
+        This returns an array of cp data and a list of the indices of lines
+        containing flawed data. The whole file is parsed by one call to
+        numpy; only if that fails, or does not give one value per line, is
+        each line converted in turn to find the flawed ones.
         """
-        cp = []
-        errors = []
         with open(pathName,'r') as f:
             f.readline()
-            for i, line in enumerate(f):
-                # If the line is a number, store it; if not, record the line
-                # number and move on.
-                try:
-                    cp.append(float(line.strip()))
-                except ValueError:
-                    errors.append(i)
-        return (cp,errors)
+            body = f.read()
+        # The last line ends with a newline, which does not start a new line
+        nLines = body.count('\n')
+        if body != '' and not body.endswith('\n'):
+            nLines += 1
+        if nLines == 0:
+            return (np.zeros(0),[])
+        # loadtxt skips blank lines, so its result is only used if it has one
+        # value on each line, and a file of only blank lines is left to the
+        # line by line check
+        if not body.isspace():
+            try:
+                cp = np.loadtxt(io.StringIO(body),dtype=np.float64,
+                                comments=None,ndmin=2)
+                if cp.shape == (nLines,1):
+                    return (cp[:,0],[])
+            except ValueError:
+                pass
+        lines = body.split('\n')
+        if lines[-1] == '':
+            lines.pop()
+        cp = []
+        errors = []
+        for i, line in enumerate(lines):
+            # If the line is a number, store it; if not, record the line
+            # number and move on.
+            try:
+                cp.append(float(line.strip()))
+            except ValueError:
+                errors.append(i)
+        return (np.array(cp),errors)
 
-    def dcx(self,alpha,i):
+    def cp_angle(self,pathName):
         """
-        Finds the pressure increment in the x direction for a given attack
-        angle and location on the airfoil.
-        
-        Uses equation dcx = -(cp * dy) / chord
+        Finds the attack angle from the name of a cp file.
+
+        The name is alpha<angle>.dat. This returns None if the angle is not
+        a number.
         """
-        y1 = self.__y[i]
-        y2 = self.__y[i+1]
-        dy = y2 - y1
-        cp = self.__cpAlpha[alpha][i]
-        return -cp * dy / self.__chord
+        fileName = os.path.split(pathName)[1]
+        try:
+            return float(fileName[5:-4])
+        except ValueError:
+            return None
 
-    def dcy(self,alpha,i):
+    def cp_message(self,pathName,kind,info):
         """
-        Finds the pressure increment in the y direction for a given attack
-        angle and location on the airfoil.
-        
-        Uses equation dcy = (cp * dx) / chord
+        Gives the error message for a flawed cp file, from the kind of error
+        found (as returned by read_all_cp) and its details.
+        """
+        alpha = self.cp_angle(pathName)
+        if kind == 'name':
+            return "ERROR: {} has improper name".format(pathName)
+        if kind == 'numerical':
+            string = "ERROR: Non-numerical cp data at alpha = {}: {}"
+            return string.format(alpha,info)
+        if kind == 'empty':
+            return "ERROR: {} has no data".format(alpha)
+        if kind == 'many':
+            return "ERROR: {} has too many values".format(pathName)
+        return "ERROR: {} has too few values".format(pathName)
+
+    def read_all_cp(self,pathNames):
+        """
+        Reads the cp data from the given cp files, using a pool of threads.
+
+        For each file, identify the angle, and read the file. The data is
+        returned in a dictionary using the attack angles (converted to
+        numbers) as keys and arrays with the data as values. If any error is
+        identified, an appropriate message is printed, and the file in
+        question is skipped, allowing the program to continue with the valid
+        data. The errors are also returned in a dictionary, using the path
+        names as keys and tuples of the kind of error ('name', 'numerical',
+        'empty', 'many', or 'few') and its details as values.
         """
-        x1 = self.__x[i]
-        x2 = self.__x[i+1]
-        dx = x2 - x1
-        cp = self.__cpAlpha[alpha][i]
-        return cp * dx / self.__chord
+        angles = [self.cp_angle(pathName) for pathName in pathNames]
+        # The files are read at the same time, but checked in order, so the
+        # messages are printed in the same order as when reading one at a
+        # time.
+        valid = [pathName for (pathName,alpha) in zip(pathNames,angles)
+                 if alpha is not None]
+        with concurrent.futures.ThreadPoolExecutor(self.__threads) as executor:
+            data = executor.map(self.read_cp,valid)
+            cpAlpha = dict()
+            problems = dict()
+            for (pathName,alpha) in zip(pathNames,angles):
+                info = None
+                if alpha is None:
+                    kind = 'name'
+                else:
+                    (cp,errors) = next(data)
+                    if len(errors) > 0:
+                        (kind,info) = ('numerical',errors)
+                    elif len(cp) == self.__lenData:
+                        cpAlpha[alpha] = cp
+                        continue
+                    elif len(cp) == 0:
+                        kind = 'empty'
+                    elif len(cp) > self.__lenData:
+                        kind = 'many'
+                    else:
+                        kind = 'few'
+                print(self.cp_message(pathName,kind,info))
+                problems[pathName] = (kind,info)
+        return (cpAlpha,problems)
+
+    def file_stamps(self,cpPaths):
+        """
+        Finds the size and modification time of the xy file and each of the
+        given cp files. This returns a dictionary using the file names as
+        keys. Files that no longer exist are left out.
+        """
+        stamps = dict()
+        for pathName in [self.__xyPath] + cpPaths:
+            try:
+                info = os.stat(pathName)
+            except OSError:
+                continue
+            stamps[os.path.split(pathName)[1]] = [info.st_size,
+                                                  info.st_mtime_ns]
+        return stamps
+
+    def read_cache(self,stamps):
+        """
+        Reads the cache file.
+
+        If the cache exists and was written from files with the given
+        stamps, this returns the NACA id, the x and y data, the sorted
+        angles, the cp matrix, and a list of the file name, kind of error,
+        and details of each flawed cp file. Otherwise it returns None.
+        """
+        try:
+            with np.load(self.__cachePath,allow_pickle=False) as data:
+                meta = json.loads(str(data['meta']))
+                if meta['version'] != CACHE_VERSION:
+                    return None
+                if meta['stamps'] != stamps:
+                    return None
+                return (meta['nacaId'],data['x'],data['y'],data['angles'],
+                        data['cp'],meta['problems'])
+        except (OSError,ValueError,KeyError):
+            return None
+
+    def write_cache(self):
+        """
+        Writes the cache file, with the data, the errors found, and the
+        stamps of the files it was read from.
+
+        The cache is written to a temporary file that then replaces the old
+        cache, so a cache that was only partly written is never used. If the
+        cache cannot be written (for example, the directory is read-only),
+        the data is still used.
+        """
+        problems = []
+        for pathName in self.__cpPaths:
+            if pathName in self.__problems:
+                (kind,info) = self.__problems[pathName]
+                problems.append([os.path.split(pathName)[1],kind,info])
+        meta = {'version': CACHE_VERSION, 'stamps': self.__stamps,
+                'nacaId': self.__nacaId, 'problems': problems}
+        try:
+            with open(self.__cachePath + ".tmp",'wb') as f:
+                np.savez(f,meta=np.array(json.dumps(meta)),x=self.__x,
+                         y=self.__y,angles=self.__angles,cp=self.__cp)
+            os.replace(self.__cachePath + ".tmp",self.__cachePath)
+        except OSError:
+            pass
+
+    def set_geometry(self,nacaId,x,y):
+        """
+        Stores the NACA id and the x and y data, and calculates the chord
+        length. Any cp data and results already stored are cleared, since
+        they depend on the shape of the airfoil.
+        """
+        self.__nacaId = nacaId
+        self.__x = x
+        self.__y = y
+        self.__lenData = len(self.__x) - 1
+        # Calculate the chord length (the distance from the point with the
+        # lowest x value to the point with the highest x value).
+        lead = np.argmin(self.__x)
+        trail = np.argmax(self.__x)
+        self.__chord = math.hypot(self.__x[lead] - self.__x[trail],
+                                  self.__y[lead] - self.__y[trail])
+        self.__angles = np.zeros(0)
+        self.__cp = np.zeros((0,self.__lenData))
+        self.__cl = np.zeros(0)
+        self.__stags = np.zeros((0,3))
+
+    def add_angles(self,angles,cp):
+        """
+        Stores the cp data at the given sorted angles, replacing any data
+        already stored at the same angles.
+
+        The lift coefficients and stagnation points are only calculated for
+        the new angles, and all the arrays are kept in order of angle.
+        """
+        keep = ~np.isin(self.__angles,angles)
+        allAngles = np.concatenate((self.__angles[keep],angles))
+        order = np.argsort(allAngles,kind='stable')
+        self.__angles = allAngles[order]
+        self.__cp = np.concatenate((self.__cp[keep],cp))[order]
+        self.__cl = np.concatenate((self.__cl[keep],
+                                    self.calc_cls(angles,cp)))[order]
+        self.__stags = np.concatenate((self.__stags[keep],
+                                       self.calc_stags(cp)))[order]
+
+    def load(self,alpha=None):
+        """
+        Reads the cp files that have not been read yet, and calculates their
+        results.
+
+        If an angle is given, only the files at that angle are read;
+        otherwise all of them are. Once every file has been read, the data
+        is written to the cache.
+        """
+        if alpha is None:
+            pathNames = list(self.__pending)
+        else:
+            pathNames = [pathName for (pathName,pathAlpha)
+                         in self.__pending.items() if pathAlpha == alpha]
+        if len(pathNames) == 0:
+            return
+        (cpAlpha,problems) = self.read_all_cp(pathNames)
+        for pathName in pathNames:
+            del self.__pending[pathName]
+        self.__problems.update(problems)
+        # The cp data is stored as a matrix with one row per angle, in order
+        # of angle.
+        if len(cpAlpha) > 0:
+            angles = np.array(sorted(cpAlpha.keys()))
+            cp = np.array([cpAlpha[a] for a in angles])
+            self.add_angles(angles,cp)
+        if len(self.__pending) == 0 and self.__cachePath is not None:
+            self.write_cache()
+
+    def refresh(self):
+        """
+        Scans the directory for cp files again, and reads the files that
+        were added or changed since the last scan (or marks them to be read
+        when needed, in lazy mode).
+
+        The results at angles whose files were removed are dropped. If the
+        xy data changed, everything is read again. This returns a sorted
+        list of the angles whose files were added, changed, or removed.
+        """
+        cpPaths = glob.glob(self.__inputdir+"alpha*.dat")
+        stamps = self.file_stamps(cpPaths)
+        cpPaths = [pathName for pathName in cpPaths
+                   if os.path.split(pathName)[1] in stamps]
+        if stamps == self.__stamps:
+            return []
+        xyName = os.path.split(self.__xyPath)[1]
+        if xyName not in stamps:
+            raise RuntimeError('No xy data')
+
+        # On the first scan, if the cache matches the files, use its data,
+        # and print the error messages that reading the files gave.
+        if len(self.__stamps) == 0 and self.__cachePath is not None:
+            cached = self.read_cache(stamps)
+            if cached is not None:
+                (nacaId,x,y,angles,cp,problems) = cached
+                self.set_geometry(nacaId,x,y)
+                self.add_angles(angles,cp)
+                for (fileName,kind,info) in problems:
+                    pathName = self.__inputdir + fileName
+                    self.__problems[pathName] = (kind,info)
+                    print(self.cp_message(pathName,kind,info))
+                self.__cpPaths = cpPaths
+                self.__stamps = stamps
+                return self.__angles.tolist()
+
+        # Find the files that were added, changed, or removed. If the xy
+        # data changed, all the cp files need to be read again.
+        if stamps[xyName] != self.__stamps.get(xyName):
+            self.set_geometry(*self.read_xy())
+            changed = set(cpPaths) | set(self.__cpPaths)
+            self.__pending = dict()
+            self.__problems = dict()
+        else:
+            changed = set(self.__cpPaths) - set(cpPaths)
+            for pathName in cpPaths:
+                fileName = os.path.split(pathName)[1]
+                if stamps[fileName] != self.__stamps.get(fileName):
+                    changed.add(pathName)
+        affected = set(self.cp_angle(pathName) for pathName in changed)
+        affected.discard(None)
+
+        # Drop the results at the affected angles, and mark every file at
+        # those angles (and every changed file) to be read again.
+        keep = ~np.isin(self.__angles,list(affected))
+        self.__angles = self.__angles[keep]
+        self.__cp = self.__cp[keep]
+        self.__cl = self.__cl[keep]
+        self.__stags = self.__stags[keep]
+        for pathName in changed:
+            self.__pending.pop(pathName,None)
+            self.__problems.pop(pathName,None)
+        for pathName in cpPaths:
+            alpha = self.cp_angle(pathName)
+            if pathName in changed or alpha in affected:
+                self.__problems.pop(pathName,None)
+                self.__pending[pathName] = alpha
+        self.__cpPaths = cpPaths
+        self.__stamps = stamps
+        if len(self.__pending) > 0:
+            if not self.__lazy:
+                self.load()
+        elif len(cpPaths) > 0 and self.__cachePath is not None:
+            # Only files were removed, so the cache just needs updating.
+            self.write_cache()
+        return sorted(affected)
+
+    def dcx(self):
+        """
+        Finds the pressure increment in the x direction on each panel at
+        each attack angle.
+
+        Uses equation dcx = -(cp * dy) / chord, with one row per angle and
+        one column per panel.
+        """
+        self.load()
+        dy = np.diff(self.__y)
+        return -self.__cp * dy / self.__chord
+
+    def dcy(self):
+        """
+        Finds the pressure increment in the y direction on each panel at
+        each attack angle.
+
+        Uses equation dcy = (cp * dx) / chord, with one row per angle and
+        one column per panel.
+        """
+        self.load()
+        dx = np.diff(self.__x)
+        return self.__cp * dx / self.__chord
 
     def lift_coeff(self,alpha):
         """
         Finds the lift coefficient at a given attack angle.
-        
-        Adds up each individual dcx and dcy to find cx and cy, and
-        calculates lift coefficient using the equation
-        cl = cy * cos(alpha) - cx * sin(alpha)
-        """
-        cx = 0.0
-        cy = 0.0
-        # Math module assumes that angles are in radians for trigonometry.
-        alphar = math.radians(alpha)
-        for i in range(len(self.__x) - 1):
-            cx += self.dcx(alpha,i)
-            cy += self.dcy(alpha,i)
-        cl = cy * math.cos(alphar) - cx * math.sin(alphar)
-        return cl
 
-    def calc_cls(self):
+        Looks up the angle among the calculated lift coefficients, first
+        reading the data at that angle if it has not been read yet. Raises a
+        KeyError if there is no valid data at that angle.
+        """
+        if len(self.__pending) > 0:
+            self.load(alpha)
+        i = np.searchsorted(self.__angles,alpha)
+        if i == len(self.__angles) or self.__angles[i] != alpha:
+            raise KeyError(alpha)
+        return float(self.__cl[i])
+
+    def calc_cls(self,angles=None,cp=None):
         """
-        Finds the lift coefficient for each attack angle.
+        Finds the lift coefficient for each attack angle, given the angles
+        and a matrix of the cp data with one row per angle (by default, all
+        the angles).
+
+        The sums of dcx and dcy over the panels give cx and cy at every
+        angle from one matrix-vector product each, and the lift coefficient
+        is found using the equation cl = cy * cos(alpha) - cx * sin(alpha)
         """
-        cl = dict()
-        for alpha in self.__angles:
-            cl[alpha] = self.lift_coeff(alpha)
+        if angles is None:
+            self.load()
+            (angles,cp) = (self.__angles,self.__cp)
+        cx = -(cp @ np.diff(self.__y)) / self.__chord
+        cy = (cp @ np.diff(self.__x)) / self.__chord
+        # Numpy assumes that angles are in radians for trigonometry.
+        alphar = np.radians(angles)
+        cl = cy * np.cos(alphar) - cx * np.sin(alphar)
+        # When the forces cancel, the sign of the rounding error depends on
+        # the order of the sum, and would be printed as 0.0000 or -0.0000.
+        # Results that are zero up to rounding error, compared with the size
+        # of the terms summed, are set to exactly zero.
+        scale = (np.abs(cp) @ (np.abs(np.diff(self.__x)) +
+                               np.abs(np.diff(self.__y)))) / self.__chord
+        cl[np.abs(cl) <= ROUNDING * scale] = 0.0
         return cl
 
     def stagnation(self,alpha):
         """
         Finds the stagnation point for a given attack angle.
 
-        The stagnation point is the point where cp is closest to 1. This 
-        identifies that line segment, and returns the average x and y values
-        of the segment, as well as the cp value.
+        Looks up the angle among the calculated stagnation points, and
+        returns the x and y values and the cp value, first reading the data
+        at that angle if it has not been read yet. Raises a KeyError if
+        there is no valid data at that angle.
+        """
+        if len(self.__pending) > 0:
+            self.load(alpha)
+        i = np.searchsorted(self.__angles,alpha)
+        if i == len(self.__angles) or self.__angles[i] != alpha:
+            raise KeyError(alpha)
+        return tuple(float(value) for value in self.__stags[i])
+
+    def calc_stags(self,cp=None):
+        """
+        Finds the stagnation point for each attack angle, given a matrix of
+        the cp data with one row per angle (by default, all the angles).
+
+        The stagnation point is the point where cp is closest to 1. This
+        identifies that line segment at every angle at once (the first one
+        if several are equally close), and returns an array with the
+        average x and y values of each segment, as well as the cp value.
         """
-        stag = []
-        for cp in self.__cpAlpha[alpha]:
-            stag.append(abs(1-cp))
-        stagMin = min(stag)
-        ind = stag.index(stagMin)
-        cpStag = self.__cpAlpha[alpha][ind]
+        if cp is None:
+            self.load()
+            cp = self.__cp
+        rows = np.arange(len(cp))
+        ind = np.argmin(np.abs(1 - cp),axis=1)
         xp = (self.__x[ind] + self.__x[ind + 1]) / 2
         yp = (self.__y[ind] + self.__y[ind + 1]) / 2
-        return (xp,yp,cpStag)
+        return np.column_stack((xp,yp,cp[rows,ind]))
 
-    def calc_stags(self):
+    def results(self):
         """
-        Finds the stagnation point for each attack angle.
+        Returns the results for use by other programs.
+
+        This returns the NACA id, and copies of the arrays of the sorted
+        angles, the lift coefficient at each angle, and the stagnation
+        point at each angle (one row per angle, holding the x and y values
+        and the cp value). Any data that has not been read yet is read
+        first.
         """
-        stags = dict()
-        for alpha in self.__angles:
-            stags[alpha] = self.stagnation(alpha)
-        return stags
-    
+        self.load()
+        return (self.__nacaId,self.__angles.copy(),self.__cl.copy(),
+                self.__stags.copy())
+
+    def interpolant(self,kind='linear'):
+        """
+        Creates an interpolant of the lift coefficients and stagnation
+        points over the sorted angles (see AirfoilInterpolant), with linear
+        ('linear') or monotone cubic ('pchip') interpolation.
+
+        Any data that has not been read yet is read first. The interpolant
+        holds a copy of the results, so a new one is needed after refresh().
+        """
+        self.load()
+        return AirfoilInterpolant(self.__angles,self.__cl,self.__stags,kind)
+
     def __repr__(self):
         """
         Converts the airfoil object to a string when being printed.
         
         This includes the NACA id and a line for each valid attack angle
-        giving the lift coefficient and stagnation point.
+        giving the lift coefficient and stagnation point. Any data that has
+        not been read yet is read first.
         """
+        self.load()
         string = "Test case: " + self.__nacaId + '\n\n'
         string += "  alpha     cl           stagnation pt\n"
         string += "  -----  -------  --------------------------\n"
         form = "  {0: .2f}  {1: .4f}  ({2[0]: .4f}, {2[1]: .4f})  {2[2]:.4f}\n"
-        for alpha in self.__angles:
-            string += form.format(alpha,self.__cl[alpha],self.__stags[alpha])
+        for (alpha,cl,stag) in zip(self.__angles,self.__cl,self.__stags):
+            string += form.format(alpha,cl,stag)
         return string
@@ -0,0 +1,117 @@
+import contextlib
+import csv
+import glob
+import io
+import multiprocessing
+import sys
+import time
+
+import airfoil
+
+# Function to build the Airfoil object for one directory.
+# Returns a tuple of the directory, the results (see Airfoil.results), or
+# None if the directory could not be processed, the error message, or None,
+# and the messages printed while reading the data. The messages are captured
+# so that the messages of directories processed at the same time by
+# different workers are not mixed up.
+def process_directory(inputdir):
+    messages = io.StringIO()
+    with contextlib.redirect_stdout(messages):
+        try:
+            a = airfoil.Airfoil(inputdir)
+        except RuntimeError as e:
+            return (inputdir,None,str(e),messages.getvalue())
+    return (inputdir,a.results(),None,messages.getvalue())
+
+# Function to process a list of directories, in a pool of nWorkers processes
+# if nWorkers is more than 1. The results are returned in the order of the
+# directories.
+def process_directories(inputdirs,nWorkers):
+    if nWorkers == 1:
+        for inputdir in inputdirs:
+            yield process_directory(inputdir)
+        return
+    # Each worker is given several directories at a time, to cut down on the
+    # cost of sending tasks and results between processes
+    chunkSize = max(1,min(16,len(inputdirs) // (4 * nWorkers)))
+    with multiprocessing.get_context('fork').Pool(nWorkers) as pool:
+        for result in pool.imap(process_directory,inputdirs,chunkSize):
+            yield result
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3:
+        print('Usage:')
+        print('  python3 {} <output_csv> <airfoil data directory> [...] [options]'
+              .format(sys.argv[0]))
+        print('Directories may be given as glob patterns, such as "sweep/naca*".')
+        print('Options:')
+        print('  --workers <n>    number of processes to use (default = 1)')
+        sys.exit(0)
+
+    outputFile = sys.argv[1]
+    # Options are given as pairs of a name and a value; all other arguments
+    # are directories or glob patterns
+    options = {'workers': '1'}
+    inputdirs = []
+    args = sys.argv[2:]
+    i = 0
+    while i < len(args):
+        if args[i].startswith('--'):
+            name = args[i][2:]
+            if name not in options:
+                print('ERROR: unknown option {}'.format(args[i]))
+                sys.exit(2)
+            if i + 1 == len(args):
+                print('ERROR: option {} has no value'.format(args[i]))
+                sys.exit(2)
+            options[name] = args[i+1]
+            i += 2
+            continue
+        if glob.has_magic(args[i]):
+            inputdirs.extend(sorted(glob.glob(args[i])))
+        else:
+            inputdirs.append(args[i])
+        i += 1
+    try:
+        nWorkers = int(options['workers'])
+    except ValueError:
+        print('ERROR: number of workers must be an integer')
+        sys.exit(2)
+    if nWorkers < 1:
+        print('ERROR: number of workers must be positive')
+        sys.exit(2)
+    if len(inputdirs) == 0:
+        print('ERROR: no airfoil data directories given')
+        sys.exit(2)
+
+    # Write one row per valid attack angle of each airfoil. Errors are
+    # reported for each directory as main.py does, and the directory is
+    # skipped.
+    timeStart = time.time()
+    nFailed = 0
+    nRows = 0
+    with open(outputFile,'w',newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['directory','naca_id','alpha','cl','stag_x','stag_y',
+                         'stag_cp'])
+        for (inputdir,results,error,messages) in process_directories(
+                inputdirs,nWorkers):
+            for line in messages.splitlines():
+                print('{}: {}'.format(inputdir,line))
+            if error is not None:
+                print('ERROR: {}: {}'.format(inputdir,error))
+                nFailed += 1
+                continue
+            (nacaId,angles,cl,stags) = results
+            for j in range(len(angles)):
+                writer.writerow([inputdir,nacaId,repr(float(angles[j])),
+                                 repr(float(cl[j]))] +
+                                [repr(float(value)) for value in stags[j]])
+            nRows += len(angles)
+    timeElapsed = time.time() - timeStart
+
+    print('airfoils processed: {}'.format(len(inputdirs) - nFailed))
+    print('airfoils failed: {}'.format(nFailed))
+    print('rows written: {}'.format(nRows))
+    print('elapsed time: {}'.format(timeElapsed))
+    print('airfoils per second: {}'.format(len(inputdirs) / timeElapsed))
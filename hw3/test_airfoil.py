@@ -0,0 +1,62 @@
+"""
+Checks that eager and lazy Airfoil objects print the same results.
+"""
+
+# Import useful modules
+import contextlib
+import io
+import math
+import os
+import tempfile
+import unittest
+
+import airfoil
+
+def write_airfoil(inputdir,cpValue,angles,nPanels=200):
+    """
+    Writes an airfoil directory with an elliptical shape and the same cp
+    value on every panel at each of the given angles.
+    """
+    with open(os.path.join(inputdir,"xy.dat"),'w') as f:
+        f.write("NACA test\n")
+        for i in range(nPanels + 1):
+            t = 2 * math.pi * i / nPanels
+            f.write("{:.6f} {:.6f}\n".format(0.5 + 0.5 * math.cos(t),
+                                             0.06 * math.sin(t)))
+    for alpha in angles:
+        with open(os.path.join(inputdir,"alpha{:+.2f}.dat".format(alpha)),
+                  'w') as f:
+            f.write("#cp\n")
+            for i in range(nPanels):
+                f.write("{}\n".format(cpValue))
+
+class AirfoilTest(unittest.TestCase):
+    """
+    AirfoilTest: compares the printed results of eager and lazy Airfoil
+    objects built from the same directory.
+    """
+
+    def test_constant_cp(self):
+        """
+        With the same cp on every panel the forces cancel, so every lift
+        coefficient is zero up to rounding error, and must be printed as
+        0.0000 whichever way the sums were formed.
+        """
+        angles = [-4.0 + 0.5 * i for i in range(25)]
+        with tempfile.TemporaryDirectory() as inputdir:
+            write_airfoil(inputdir,0.37,angles)
+            with contextlib.redirect_stdout(io.StringIO()):
+                eager = airfoil.Airfoil(inputdir,cache=False)
+                lazy = airfoil.Airfoil(inputdir,cache=False,lazy=True)
+                # Read some of the angles one at a time before the rest
+                for alpha in angles[::3]:
+                    lazy.lift_coeff(alpha)
+                eagerString = repr(eager)
+                lazyString = repr(lazy)
+        self.assertEqual(eagerString,lazyString)
+        self.assertNotIn("-0.0000  (",eagerString)
+        for alpha in angles:
+            self.assertEqual(eager.lift_coeff(alpha),0.0)
+
+if __name__ == '__main__':
+    unittest.main()